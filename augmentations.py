@@ -1,37 +1,166 @@
 
 import torch
+import torchvision
 from typing import Tuple, Union
 import torchvision.transforms as T
 
 
+def rgb_to_grayscale(images: torch.Tensor) -> torch.Tensor:
+    r, g, b = images.unbind(dim=-3)
+    return (0.2989 * r + 0.587 * g + 0.114 * b).unsqueeze(dim=-3)
+
+
+def blend(images1: torch.Tensor, images2: torch.Tensor, ratios: torch.Tensor) -> torch.Tensor:
+    """Blend each image of images1 with the one of images2, with the ratio of its sample,
+    i.e. ratios * images1 + (1 - ratios) * images2, within a single operation.
+    """
+    return torch.lerp(images2.expand_as(images1), images1, ratios.view(-1, 1, 1, 1)).clamp_(0, 1)
+
+
+def rgb_to_hsv(images: torch.Tensor) -> torch.Tensor:
+    """Same as the RGB to HSV conversion of T.functional.adjust_hue."""
+    r, g, b = images.unbind(dim=-3)
+    maxc = images.max(dim=-3).values
+    minc = images.min(dim=-3).values
+    # Where maxc == minc, H and S are 0, and the denominators are replaced by 1 to avoid NaNs
+    eqc = maxc == minc
+    cr = maxc - minc
+    ones = torch.ones_like(maxc)
+    s = cr / torch.where(eqc, ones, maxc)
+    cr_divisor = torch.where(eqc, ones, cr)
+    rc = (maxc - r) / cr_divisor
+    gc = (maxc - g) / cr_divisor
+    bc = (maxc - b) / cr_divisor
+    hr = (maxc == r) * (bc - gc)
+    hg = ((maxc == g) & (maxc != r)) * (2.0 + rc - bc)
+    hb = ((maxc != g) & (maxc != r)) * (4.0 + gc - rc)
+    h = torch.fmod((hr + hg + hb) / 6.0 + 1.0, 1.0)
+    return torch.stack((h, s, maxc), dim=-3)
+
+
+def hsv_to_rgb(images: torch.Tensor) -> torch.Tensor:
+    """Inverse of rgb_to_hsv(), computing each channel as v - v * s * clamp(min(k, 4 - k), 0, 1),
+    where k = (n + 6 * h) % 6 with n = 5, 3, 1 for red, green and blue. This is the same as the
+    piecewise conversion of T.functional.adjust_hue, without building all its cases.
+    """
+    h, s, v = images.unsqueeze(dim=-3).unbind(dim=-4)
+    n = torch.tensor([5.0, 3.0, 1.0], dtype=images.dtype, device=images.device).view(3, 1, 1)
+    k = torch.remainder(n + 6.0 * h, 6.0)
+    return v - v * s * torch.minimum(k, 4.0 - k).clamp_(0, 1)
+
+
+def adjust_brightness(images: torch.Tensor, factors: torch.Tensor) -> torch.Tensor:
+    return (factors.view(-1, 1, 1, 1) * images).clamp_(0, 1)
+
+
+def adjust_contrast(images: torch.Tensor, factors: torch.Tensor) -> torch.Tensor:
+    means = rgb_to_grayscale(images).mean(dim=(-3, -2, -1), keepdim=True)
+    return blend(images, means, factors)
+
+
+def adjust_saturation(images: torch.Tensor, factors: torch.Tensor) -> torch.Tensor:
+    return blend(images, rgb_to_grayscale(images), factors)
+
+
+def adjust_hue(images: torch.Tensor, factors: torch.Tensor) -> torch.Tensor:
+    h, s, v = rgb_to_hsv(images).unbind(dim=-3)
+    h = (h + factors.view(-1, 1, 1)) % 1.0
+    return hsv_to_rgb(torch.stack((h, s, v), dim=-3))
+
+
 class DeviceAgnosticColorJitter(T.ColorJitter):
     def __init__(self, brightness: float = 0., contrast: float = 0., saturation: float = 0., hue: float = 0.):
-        """This is the same as T.ColorJitter but it only accepts batches of images and works on GPU"""
+        """This is the same as T.ColorJitter but it only accepts batches of float images and works on GPU.
+        Like T.ColorJitter applied to each image, each image gets its own factors and its own
+        (random) order of the four adjustments, but these are applied to the whole batch at once.
+        """
         super().__init__(brightness=brightness, contrast=contrast, saturation=saturation, hue=hue)
+        self.adjust_functions = [adjust_brightness, adjust_contrast, adjust_saturation, adjust_hue]
+    
+    def get_batch_params(self, batch_size: int):
+        """Return, like T.ColorJitter.get_params for each image, the order in which each image gets the
+        adjustments, with shape [batch_size, 4], and the factors of the brightness, contrast, saturation
+        and hue of each image, each one with shape [batch_size], or None if the adjustment is disabled.
+        They are drawn on CPU, so that the results are the same on any device.
+        """
+        fns_idx = torch.rand(batch_size, 4).argsort(dim=1)
+        factors = [None if bounds is None else torch.empty(batch_size).uniform_(bounds[0], bounds[1])
+                   for bounds in [self.brightness, self.contrast, self.saturation, self.hue]]
+        return fns_idx, factors
     
     def forward(self, images: torch.Tensor) -> torch.Tensor:
         assert len(images.shape) == 4, f"images should be a batch of images, but it has shape {images.shape}"
+        assert images.is_floating_point(), f"images should be float within [0, 1], but they are {images.dtype}"
         B, C, H, W = images.shape
-        # Applies a different color jitter to each image
-        color_jitter = super(DeviceAgnosticColorJitter, self).forward
-        augmented_images = [color_jitter(img).unsqueeze(0) for img in images]
-        augmented_images = torch.cat(augmented_images)
+        fns_idx, factors = self.get_batch_params(B)
+        augmented_images = images.clone()
+        # At each step, each adjustment is applied to the images which get it at that step
+        for step in range(4):
+            for fn_id, (adjust_function, fn_factors) in enumerate(zip(self.adjust_functions, factors)):
+                if fn_factors is None:
+                    continue
+                images_idx = torch.nonzero(fns_idx[:, step] == fn_id).squeeze(1)
+                if len(images_idx) == B:
+                    augmented_images = adjust_function(augmented_images, fn_factors.to(images.device))
+                elif len(images_idx) > 0:
+                    fn_factors = fn_factors[images_idx].to(images.device)
+                    images_idx = images_idx.to(images.device)
+                    augmented_images[images_idx] = adjust_function(augmented_images[images_idx], fn_factors)
         assert augmented_images.shape == torch.Size([B, C, H, W])
         return augmented_images
 
 
 class DeviceAgnosticRandomResizedCrop(T.RandomResizedCrop):
     def __init__(self, size: Union[int, Tuple[int, int]], scale: float):
-        """This is the same as T.RandomResizedCrop but it only accepts batches of images and works on GPU"""
+        """This is the same as T.RandomResizedCrop but it only accepts batches of images and works on GPU.
+        Each image gets its own crop, drawn like T.RandomResizedCrop does, and all the crops are resized
+        at once with roi_align. It samples the same points as a bilinear resize (except that at the borders
+        of a crop it interpolates with the pixels just outside of it, instead of repeating the border), and
+        when a crop is shrunk it averages several samples per output pixel, which acts as the antialiasing.
+        """
         super().__init__(size=size, scale=scale, antialias=True)
     
+    def get_batch_params(self, batch_size: int, height: int, width: int) -> torch.Tensor:
+        """Return the crop of each image, as a tensor with shape [batch_size, 4] of (i, j, h, w),
+        drawn like T.RandomResizedCrop.get_params for each image: the first of 10 random crops which
+        fits in the image, or else a central crop. They are drawn on CPU, so that the results are the
+        same on any device.
+        """
+        area = height * width
+        log_ratio = torch.log(torch.tensor(self.ratio, dtype=torch.float64))
+        target_areas = area * torch.empty(batch_size, 10, dtype=torch.float64).uniform_(self.scale[0], self.scale[1])
+        aspect_ratios = torch.exp(torch.empty(batch_size, 10, dtype=torch.float64).uniform_(log_ratio[0], log_ratio[1]))
+        widths = torch.round(torch.sqrt(target_areas * aspect_ratios))
+        heights = torch.round(torch.sqrt(target_areas / aspect_ratios))
+        fits = (0 < widths) & (widths <= width) & (0 < heights) & (heights <= height)
+        first_fit = fits.to(torch.uint8).argmax(dim=1, keepdim=True)
+        w = widths.gather(1, first_fit).squeeze(1)
+        h = heights.gather(1, first_fit).squeeze(1)
+        i = torch.floor(torch.rand(batch_size, dtype=torch.float64) * (height - h + 1))
+        j = torch.floor(torch.rand(batch_size, dtype=torch.float64) * (width - w + 1))
+        
+        # Fallback to central crop for the images where none of the crops fits
+        in_ratio = float(width) / float(height)
+        if in_ratio < min(self.ratio):
+            central_w, central_h = width, int(round(width / min(self.ratio)))
+        elif in_ratio > max(self.ratio):
+            central_w, central_h = int(round(height * max(self.ratio))), height
+        else:  # whole image
+            central_w, central_h = width, height
+        central_crop = torch.tensor([(height - central_h) // 2, (width - central_w) // 2, central_h, central_w],
+                                    dtype=torch.float64)
+        crops = torch.stack([i, j, h, w], dim=1)
+        return torch.where(fits.any(dim=1, keepdim=True), crops, central_crop).to(torch.int64)
+    
     def forward(self, images: torch.Tensor) -> torch.Tensor:
         assert len(images.shape) == 4, f"images should be a batch of images, but it has shape {images.shape}"
         B, C, H, W = images.shape
-        # Applies a different color jitter to each image
-        random_resized_crop = super(DeviceAgnosticRandomResizedCrop, self).forward
-        augmented_images = [random_resized_crop(img).unsqueeze(0) for img in images]
-        augmented_images = torch.cat(augmented_images)
+        i, j, h, w = self.get_batch_params(B, H, W).unbind(dim=1)
+        # Each box is (index of its image, x1, y1, x2, y2), where x2 and y2 are the borders of the crop
+        boxes = torch.stack([torch.arange(B), j, i, j + w, i + h], dim=1).to(images.device, images.dtype)
+        augmented_images = torchvision.ops.roi_align(images, boxes, output_size=self.size,
+                                                     sampling_ratio=-1, aligned=True)
+        assert augmented_images.shape == torch.Size([B, C, *self.size])
         return augmented_images
 
 
@@ -0,0 +1,64 @@
+
+"""Time the batched augmentations of augmentations.py against applying the torchvision
+transforms to one image at a time (as the augmentations used to do), for example
+python benchmark_augmentations.py --device cuda --batch_size 64
+"""
+
+import time
+import torch
+import argparse
+import torchvision.transforms as T
+
+import augmentations
+
+
+def loop_over_images(transform):
+    """Apply transform to each image of the batch, like the augmentations used to do."""
+    return lambda images: torch.stack([transform(image) for image in images])
+
+
+def time_function(function, images, iterations, device):
+    function(images)  # Warm up
+    if device == "cuda":
+        torch.cuda.synchronize()
+    start_time = time.perf_counter()
+    for _ in range(iterations):
+        function(images)
+    if device == "cuda":
+        torch.cuda.synchronize()
+    return (time.perf_counter() - start_time) / iterations
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument("--device", type=str, default="cuda", choices=["cuda", "cpu"], help="_")
+    parser.add_argument("--batch_size", type=int, default=64, help="_")
+    parser.add_argument("--input_size", type=int, default=512, help="size of the images given to the augmentations")
+    parser.add_argument("--image_size", type=int, default=512, help="size of the images after the crop")
+    parser.add_argument("--iterations", type=int, default=10, help="_")
+    parser.add_argument("--brightness", type=float, default=0.7, help="_")
+    parser.add_argument("--contrast", type=float, default=0.7, help="_")
+    parser.add_argument("--hue", type=float, default=0.5, help="_")
+    parser.add_argument("--saturation", type=float, default=0.7, help="_")
+    parser.add_argument("--random_resized_crop", type=float, default=0.5, help="_")
+    args = parser.parse_args()
+
+    images = torch.rand(args.batch_size, 3, args.input_size, args.input_size, device=args.device)
+    # For each augmentation, the per-image torchvision transform and the batched one
+    benchmarks = {
+        "ColorJitter": (
+            loop_over_images(T.ColorJitter(args.brightness, args.contrast, args.saturation, args.hue)),
+            augmentations.DeviceAgnosticColorJitter(args.brightness, args.contrast, args.saturation, args.hue),
+        ),
+        "RandomResizedCrop": (
+            loop_over_images(T.RandomResizedCrop([args.image_size, args.image_size],
+                                                 scale=[1 - args.random_resized_crop, 1], antialias=True)),
+            augmentations.DeviceAgnosticRandomResizedCrop([args.image_size, args.image_size],
+                                                          scale=[1 - args.random_resized_crop, 1]),
+        ),
+    }
+    for name, (per_image_function, batched_function) in benchmarks.items():
+        per_image_time = time_function(per_image_function, images, args.iterations, args.device)
+        batched_time = time_function(batched_function, images, args.iterations, args.device)
+        print(f"{name:<20} per image: {per_image_time * 1000:8.1f} ms   batched: {batched_time * 1000:8.1f} ms   "
+              f"speedup: x{per_image_time / batched_time:.2f}")
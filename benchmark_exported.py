@@ -0,0 +1,76 @@
+
+"""Measure the latency and throughput on CPU of the models exported by export.py, for each batch
+size and number of threads, e.g.
+python benchmark_exported.py --models exported_models/ResNet50_2048.torchscript.pt exported_models/ResNet50_2048.onnx
+This script does not import this repo nor torchvision, like a deployment of the exported models
+(onnxruntime is needed only for the .onnx models).
+"""
+
+import json
+import time
+import torch
+import argparse
+import numpy as np
+
+
+def load_model(path, threads_num):
+    """Return a function which computes the descriptors of a float32 numpy batch of images
+    with the model exported in path, using threads_num threads.
+    """
+    if path.endswith(".onnx"):
+        import onnxruntime
+        session_options = onnxruntime.SessionOptions()
+        session_options.intra_op_num_threads = threads_num
+        session_options.inter_op_num_threads = 1
+        session = onnxruntime.InferenceSession(path, session_options, providers=["CPUExecutionProvider"])
+        return lambda images: session.run(None, {"images": images})[0]
+    torch.set_num_threads(threads_num)
+    traced_model = torch.jit.load(path, map_location="cpu")
+    def run_traced_model(images):
+        with torch.inference_mode():
+            return traced_model(torch.from_numpy(images)).numpy()
+    return run_traced_model
+
+
+def measure_latencies(model, images, iterations, warmup_iterations):
+    """Return the latency in seconds of each of the iterations calls of model(images)."""
+    for _ in range(warmup_iterations):
+        model(images)
+    latencies = np.empty(iterations)
+    for i in range(iterations):
+        start_time = time.perf_counter()
+        model(images)
+        latencies[i] = time.perf_counter() - start_time
+    return latencies
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument("--models", type=str, nargs="+", required=True,
+                        help="paths of the models exported by export.py (.torchscript.pt or .onnx)")
+    parser.add_argument("--batch_sizes", type=int, nargs="+", default=[1, 8, 32], help="_")
+    parser.add_argument("--threads", type=int, nargs="+", default=[1, torch.get_num_threads()],
+                        help="numbers of CPU threads to run the models with")
+    parser.add_argument("--image_size", type=int, default=512, help="_")
+    parser.add_argument("--iterations", type=int, default=20, help="_")
+    parser.add_argument("--warmup_iterations", type=int, default=3, help="_")
+    parser.add_argument("--output_json", type=str, default=None, help="path where to save the results")
+    args = parser.parse_args()
+
+    results = []
+    print(f"{'model':<45} {'threads':>7} {'batch':>5} {'p50 ms':>9} {'p90 ms':>9} {'p99 ms':>9} {'images/sec':>10}")
+    for path in args.models:
+        for threads_num in args.threads:
+            model = load_model(path, threads_num)
+            for batch_size in args.batch_sizes:
+                images = np.random.rand(batch_size, 3, args.image_size, args.image_size).astype(np.float32)
+                latencies = measure_latencies(model, images, args.iterations, args.warmup_iterations)
+                p50, p90, p99 = np.percentile(latencies, [50, 90, 99]) * 1000
+                images_per_second = batch_size * args.iterations / latencies.sum()
+                print(f"{path[-45:]:<45} {threads_num:>7} {batch_size:>5} {p50:9.1f} {p90:9.1f} {p99:9.1f} "
+                      f"{images_per_second:10.1f}")
+                results.append({"model": path, "threads": threads_num, "batch_size": batch_size,
+                                "p50_ms": p50, "p90_ms": p90, "p99_ms": p99, "images_per_second": images_per_second})
+    if args.output_json is not None:
+        with open(args.output_json, "w") as file:
+            json.dump(results, file, indent=2)
@@ -0,0 +1,45 @@
+
+"""Measure how many images per second the model processes with each inference backend
+(see cosplace_network.InferenceNet), and check that the descriptors match the eager ones, e.g.
+python benchmark_inference.py --backbone ResNet50 --fc_output_dim 2048 --device cpu
+"""
+
+import copy
+import torch
+import argparse
+
+import util
+from cosplace_model import cosplace_network
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument("--backbone", type=str, default="ResNet50", help="_")
+    parser.add_argument("--fc_output_dim", type=int, default=2048, help="_")
+    parser.add_argument("--resume_model", type=str, default=None, help="path to the weights of the model")
+    parser.add_argument("--device", type=str, default="cpu", choices=["cuda", "cpu"], help="_")
+    parser.add_argument("--batch_size", type=int, default=16, help="_")
+    parser.add_argument("--image_size", type=int, default=512, help="_")
+    parser.add_argument("--iterations", type=int, default=5, help="_")
+    parser.add_argument("--backends", type=str, nargs="+", default=cosplace_network.INFERENCE_BACKENDS,
+                        choices=cosplace_network.INFERENCE_BACKENDS, help="_")
+    args = parser.parse_args()
+
+    model = cosplace_network.GeoLocalizationNet(args.backbone, args.fc_output_dim)
+    if args.resume_model is not None:
+        model.load_state_dict(torch.load(args.resume_model, map_location="cpu"))
+    model = model.eval().to(args.device)
+    images = torch.rand(args.batch_size, 3, args.image_size, args.image_size, device=args.device)
+
+    with torch.no_grad():
+        eager_speed, eager_descriptors = util.images_per_second(model, images, args.iterations, args.device)
+    for backend in args.backends:
+        if backend == "eager":
+            speed, descriptors = eager_speed, eager_descriptors
+        else:
+            # InferenceNet modifies the model, so each backend gets its own copy
+            inference_model = cosplace_network.InferenceNet(copy.deepcopy(model), backend)
+            speed, descriptors = util.images_per_second(inference_model, images, args.iterations, args.device)
+        max_difference = (descriptors - eager_descriptors).abs().max().item()
+        print(f"{backend:<15} {speed:8.1f} images/sec   x{speed / eager_speed:.2f} vs eager   "
+              f"max difference of the descriptors from eager: {max_difference:.2e}")
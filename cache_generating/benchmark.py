@@ -0,0 +1,112 @@
+import os
+import json
+import argparse
+import multiprocessing
+
+from synthetic_paths import write_paths
+
+
+# The modules of each stage are imported within the process of the stage (see run_in_new_process),
+# because on Linux a new process starts with the peak memory of the process which created it.
+
+def run_centers_generation():
+    from profiling import report
+    from generate_centers_by_region import generate_centers_for_group, get_bands_idx, get_groups_features
+    stats = {}
+    with report("Generating centers", stats):
+        for scale, orientation, phase in get_groups_features():
+            get_bands_idx(generate_centers_for_group(scale, orientation, phase))
+    return stats
+
+
+def run_splitting(file_path, work_dir):
+    from profiling import report
+    from split_database_txt_by_lat import split_by_lat
+    stats = {}
+    with report("Splitting by latitude", stats):
+        split_by_lat(file_path, f"{work_dir}/lat_")
+    return stats
+
+
+def run_cache_building(file_path, cachename, num_workers):
+    from build_cache import build_cache
+    stats = {}
+    build_cache(file_path, cachename, num_workers=num_workers, stats=stats)
+    # The centers generated by build_cache are already counted within "Labeling images"
+    stats.pop("Generating centers", None)
+    return stats
+
+
+def run_in_new_process(function, *args):
+    """Run each stage in a new process, so that its peak memory does not include
+    the memory used by the previous stages.
+    """
+    with multiprocessing.get_context("spawn").Pool(1) as pool:
+        return pool.apply(function, args)
+
+
+def benchmark(images_nums, work_dir, num_workers=1, keep_files=False):
+    """Time and profile the memory of each stage of the cache generation on synthetic
+    lists of paths with images_nums images, and return {images_num: {stage_name: stats}}.
+    The centers do not depend on the images, so they are generated only once.
+    """
+    os.makedirs(work_dir, exist_ok=True)
+    centers_stats = run_in_new_process(run_centers_generation)
+    results = {}
+    for images_num in images_nums:
+        file_path = f"{work_dir}/synthetic_{images_num}_images_paths.txt"
+        cachename = f"{work_dir}/synthetic_{images_num}.torch"
+        if not os.path.exists(file_path):
+            write_paths(file_path, images_num)
+        results[images_num] = dict(centers_stats)
+        results[images_num].update(run_in_new_process(run_splitting, file_path, work_dir))
+        results[images_num].update(run_in_new_process(run_cache_building, file_path, cachename, num_workers))
+        if not keep_files:
+            os.remove(file_path)
+            os.remove(cachename)
+            for name in os.listdir(work_dir):
+                if name.startswith("lat_"):
+                    os.remove(f"{work_dir}/{name}")
+    return results
+
+
+def print_results(results, baseline=None):
+    """Print the stats of each stage, with the time per million images, which should be
+    about the same for all the sizes if the stage scales linearly. If baseline (results
+    of a previous run) is given, also print how much slower each stage is than in baseline.
+    """
+    for images_num, stages in results.items():
+        print(f"\n{images_num} images")
+        for stage_name, stats in stages.items():
+            line = (f"{stage_name:<26} {stats['seconds']:9.1f}s {stats['seconds'] / images_num * 1e6:8.2f}s per 1M images "
+                    f"{stats['peak_memory_gb']:6.2f} GB ({stats['workers_peak_memory_gb']:.2f} GB per worker)")
+            if baseline is not None and stage_name in baseline.get(str(images_num), {}):
+                line += f"   x{stats['seconds'] / max(baseline[str(images_num)][stage_name]['seconds'], 1e-9):.2f} time vs baseline"
+            print(line)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument("--images_nums", type=int, nargs="+", default=[1_000_000, 10_000_000, 40_000_000],
+                        help="number of images of each synthetic list of paths, SF-XL has about 40M")
+    parser.add_argument("--work_dir", type=str, default="benchmark",
+                        help="where to write the synthetic paths and the files made by each stage")
+    parser.add_argument("--num_workers", type=int, default=multiprocessing.cpu_count(),
+                        help="number of processes used to label the images")
+    parser.add_argument("--keep_files", action="store_true",
+                        help="keep the files made by each stage, otherwise they are deleted after each size")
+    parser.add_argument("--results_path", type=str, default="benchmark_results.json",
+                        help="where to save the results, which can then be used as --baseline")
+    parser.add_argument("--baseline", type=str, default=None,
+                        help="results of a previous run, to spot regressions")
+    args = parser.parse_args()
+
+    results = benchmark(args.images_nums, args.work_dir, args.num_workers, args.keep_files)
+    baseline = None
+    if args.baseline is not None:
+        with open(args.baseline, "r") as file:
+            baseline = json.load(file)
+    print_results(results, baseline)
+    with open(args.results_path, "w") as file:
+        json.dump(results, file, indent=2)
+    print(f"Results have been saved to: {args.results_path}")
@@ -0,0 +1,145 @@
+import torch
+import argparse
+import multiprocessing
+import numpy as np
+
+import hex_lattice
+from profiling import report
+from database_paths import BANDS_NUM, HEADINGS, get_shards, read_lines_in_chunks, parse_lines
+from generate_centers_by_region import generate_centers_for_group, get_bands_idx, get_groups_features
+
+
+labelers = None  # Set by init_labelers() in each process
+
+
+def init_labelers(groups_features):
+    global labelers
+    labelers = []
+    for scale, orientation, phase in groups_features:
+        centers = generate_centers_for_group(scale, orientation, phase)
+        labelers.append(hex_lattice.HexLatticeLabeler(centers, scale, orientation, phase,
+                                                      center_bands=get_bands_idx(centers)))
+
+
+def label_shard(file_path, start, end, first_line_idx, step, chunk_size):
+    """Label the images within a byte range of file_path.
+
+    Returns
+    -------
+    paths : list[str], paths of the images that belong to at least one class.
+    paths_bands : array with the latitude band of each of the paths.
+    memberships : array with rows of (index within paths, group_idx, class_idx).
+    """
+    paths = []
+    paths_bands = [np.zeros(0, dtype=np.int64)]
+    memberships = [np.zeros((0, 3), dtype=np.int64)]
+    for lines in read_lines_in_chunks(file_path, chunk_size, step, start, end, first_line_idx):
+        utm_east, utm_north, bands = parse_lines(lines)
+        images_idx, groups_idx, classes_idx = hex_lattice.label_images(labelers, utm_east, utm_north, bands)
+        in_bands = (0 <= bands[images_idx]) & (bands[images_idx] < BANDS_NUM)
+        images_idx, groups_idx, classes_idx = images_idx[in_bands], groups_idx[in_bands], classes_idx[in_bands]
+        # Only keep the paths of images that belong to at least one class
+        members, inverse = np.unique(images_idx, return_inverse=True)
+        memberships.append(np.stack([inverse + len(paths), groups_idx, classes_idx], axis=1))
+        paths.extend(lines[i] for i in members)
+        paths_bands.append(bands[members])
+    return paths, np.concatenate(paths_bands), np.concatenate(memberships)
+
+
+def build_cache(file_path, cachename, min_images_per_class=20, step=12, chunk_size=1_000_000,
+                groups_features=None, num_workers=1, stats=None):
+    """Build the training cache from the list of paths of SF-XL in a single pass.
+
+    This does the same as running split_database_txt_by_lat.py, generate_centers_by_region.py,
+    cal_group_and_classes_by_lat.py, merge_group_by_name.py and make_cache.py, but without
+    intermediate files: the paths are read once, in chunks of chunk_size lines, and only the
+    paths of images belonging to at least one class are kept in memory.
+    With num_workers > 1 the file is split in shards which are labeled by a pool of processes.
+    The shards are merged in order, so the cache does not depend on num_workers.
+
+    Parameters
+    ----------
+    file_path : str, file with one path per line, like database_images_paths.txt.
+    cachename : str, where to save (classes_per_group, images_per_class, HEADINGS) with torch.save.
+    min_images_per_class : int, classes with fewer images are discarded.
+    step : int, only one line every step is used, as in split_database_txt_by_lat.py.
+    chunk_size : int, number of lines labeled at once by each process, which bounds the memory usage.
+    groups_features : list of (scale, orientation, phase), by default get_groups_features().
+    num_workers : int, number of processes used to label the images.
+    stats : optional dict, where to save the time and memory taken by each stage, see report().
+    """
+    if groups_features is None:
+        groups_features = get_groups_features()
+
+    with report("Labeling images", stats):
+        if num_workers == 1:
+            with report("Generating centers", stats):
+                init_labelers(groups_features)
+            shards_results = [label_shard(file_path, 0, None, 0, step, chunk_size)]
+        else:
+            with multiprocessing.Pool(num_workers, initializer=init_labelers, initargs=(groups_features,)) as pool:
+                # Use a few shards per worker, so that the workers finish at about the same time.
+                # The workers also count the lines of the shards, to know the index of their first lines
+                shards = get_shards(file_path, num_workers * 4, pool.starmap)
+                shards_args = [(file_path, start, end, first_line_idx, step, chunk_size)
+                               for start, end, first_line_idx in shards]
+                shards_results = pool.starmap(label_shard, shards_args)
+
+        paths = []
+        paths_bands = []
+        memberships = []
+        for shard_paths, shard_paths_bands, shard_memberships in shards_results:
+            shard_memberships[:, 0] += len(paths)
+            memberships.append(shard_memberships)
+            paths.extend(shard_paths)
+            paths_bands.append(shard_paths_bands)
+        del shards_results
+        print(f"Read {len(paths)} images belonging to at least one class")
+
+    with report("Grouping images by class", stats):
+        memberships = np.concatenate(memberships)
+        paths_bands = np.concatenate(paths_bands)
+        # The images are sorted by band, as they were by the files of each band
+        memberships = memberships[np.argsort(paths_bands[memberships[:, 0]], kind="stable")]
+        # Then by class, so that the images of each class are contiguous
+        classes_keys = memberships[:, 1] * (memberships[:, 2].max(initial=0) + 1) + memberships[:, 2]
+        order = np.argsort(classes_keys, kind="stable")
+        memberships = memberships[order]
+        _, starts, counts = np.unique(classes_keys[order], return_index=True, return_counts=True)
+
+        images_per_class = {}
+        classes_per_group = {}
+        for start, count in zip(starts, counts):
+            # Each path is used with all the HEADINGS, which count as different images
+            if count * len(HEADINGS) < min_images_per_class:
+                continue  # Skip classes with too few images
+            _, group_id, class_idx = memberships[start].tolist()
+            class_id = f"{group_id}_{class_idx}"
+            images_per_class[class_id] = [paths[image_idx] for image_idx in memberships[start:start + count, 0].tolist()]
+            classes_per_group.setdefault(group_id, []).append(class_id)
+        classes_per_group = [classes_per_group[group_id] for group_id in sorted(classes_per_group)]
+        print(f"There are {len(images_per_class)} classes, with respectively the following number "
+              f"of classes per group: {[len(c) for c in classes_per_group]}")
+
+    with report("Saving cache", stats):
+        torch.save((classes_per_group, images_per_class, HEADINGS), cachename)
+    print(f"Cache has been saved to: {cachename}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument("--file_path", type=str, default="database_images_paths.txt",
+                        help="file you download from SF-XL dataset, with one path per line")
+    parser.add_argument("--cachename", type=str, default="database_scale[1,2]_orientation[0,15]_phase[0,2]_mips20.torch",
+                        help="where to save the cache")
+    parser.add_argument("--min_images_per_class", type=int, default=20, help="_")
+    parser.add_argument("--step", type=int, default=12, help="use one line every step")
+    parser.add_argument("--chunk_size", type=int, default=1_000_000,
+                        help="number of lines labeled at once by each process, reduce it to save memory")
+    parser.add_argument("--num_workers", type=int, default=multiprocessing.cpu_count(),
+                        help="number of processes used to label the images")
+    args = parser.parse_args()
+
+    with report("Building cache"):
+        build_cache(args.file_path, args.cachename, args.min_images_per_class, args.step, args.chunk_size,
+                    num_workers=args.num_workers)
@@ -1,8 +1,11 @@
 import os
+import multiprocessing
 import pandas as pd
 import numpy as np
 from tqdm import tqdm
 
+import hex_lattice
+
 
 def get_all_filenames(folder_path):
     return [filename for filename in os.listdir(folder_path) if os.path.isfile(os.path.join(folder_path, filename))]
@@ -27,36 +30,28 @@ def read_image_path_txt(filename):
     return pd.read_csv(filename, header=None, names=['path', 'utm_east', 'utm_north', 'info'])
 
 
-def main(group_idx):
-    group_centers = read_txt(f'group_centers_by_lat/group_centers_{group_idx}.txt')
-    metadata = read_image_path_txt(f'path_by_lat/lat__{group_idx}.txt')
-    metavalue = metadata[['utm_east', 'utm_north', 'info']].values
+labelers = None  # Set by init_labelers() in each process
 
-    group_centers = np.array(group_centers)
 
-    temp = []
+def init_labelers(centers_folder):
+    global labelers
+    labelers = hex_lattice.load_labelers(centers_folder)
 
-    # Calculate distance for each image
-    for item in tqdm(metavalue, total=len(metavalue)):
-        image_utm_east, image_utm_north, info = item
-        dx = np.abs(group_centers[:, 3] - image_utm_east)
-        dy = np.abs(group_centers[:, 4] - image_utm_north)
-        distance_squared = dx**2 + dy**2
-        within_lat_range = dy <= group_centers[:, 5]
-        within_lon_range = dx <= group_centers[:, 5]
-        within_distance = distance_squared <= group_centers[:, 6]
 
-        valid_centers = (within_lat_range & within_lon_range & within_distance)
-        if np.any(valid_centers):
-            matched_centers = group_centers[valid_centers]
-            temp.extend([[int(center[1]), int(center[2]), info.split(' ')[1]] for center in matched_centers])
+def main(group_idx):
+    metadata = read_image_path_txt(f'path_by_lat/lat__{group_idx}.txt')
+    utm_east = metadata['utm_east'].values
+    utm_north = metadata['utm_north'].values
+    infos = metadata['info'].values
+
+    # Find, for each image, the class of every group to which it belongs
+    images_idx, groups_idx, classes_idx = hex_lattice.label_images(labelers, utm_east, utm_north, bands=group_idx)
 
     # Saving
-    file_path = "group_info/lat37.7"+str(group_idx)+"_group.txt"
+    file_path = "group_info/lat37."+str(70 + group_idx)+"_group.txt"
     with open(file_path, 'w') as file:
-        for sublist in temp:
-            line = ' '.join(map(str, sublist)) + '\n'
-            file.write(line)
+        for image_idx, group_id, class_id in zip(tqdm(images_idx), groups_idx, classes_idx):
+            file.write(f"{group_id} {class_id} {infos[image_idx].split(' ')[1]}\n")
 
     print("Number "+str(group_idx)+" of data has been saved to:", file_path)
 
@@ -70,5 +65,7 @@ if __name__ == '__main__':
     else:
         print(f"Folder '{saving_folder_name}' already exists.")
 
-    for i in range(12):
-        main(group_idx=i)
+    # The bands are independent, so they are labeled in parallel, each one in its own file
+    num_workers = min(12, multiprocessing.cpu_count())
+    with multiprocessing.Pool(num_workers, initializer=init_labelers, initargs=('group_centers_by_lat',)) as pool:
+        pool.map(main, range(12))
@@ -0,0 +1,81 @@
+import os
+import itertools
+import numpy as np
+
+
+BANDS_NUM = 12  # Latitude bands from 37.70 to 37.81, as in split_database_txt_by_lat.py
+# Each image is used with these headings, i.e. the crops of its panorama facing 0 and 30 degrees.
+# The caches store each path once, and the dataset replaces the heading of the path with one of these.
+HEADINGS = [0, 30]
+
+
+def count_lines(file_path, start, end, block_size=1 << 24):
+    """Return the number of lines within bytes start to end of file_path, which are read in
+    blocks of block_size bytes, so that the memory used does not depend on the size of the range.
+    """
+    lines_num = 0
+    with open(file_path, 'rb') as f:
+        f.seek(start)
+        remaining = end - start
+        while remaining > 0:
+            block = f.read(min(block_size, remaining))
+            if len(block) == 0:
+                break
+            lines_num += block.count(b'\n')
+            remaining -= len(block)
+    return lines_num
+
+
+def get_shards(file_path, shards_num, starmap=itertools.starmap):
+    """Split file_path into at most shards_num byte ranges which start at the beginning of a line,
+    and return a list of (start, end, first_line_idx), where first_line_idx is the index within
+    the file of the first line of the range. The lines of the shards are counted with starmap,
+    e.g. the one of a multiprocessing.Pool to count them in parallel.
+    """
+    size = os.path.getsize(file_path)
+    offsets = [0]
+    with open(file_path, 'rb') as f:
+        for k in range(1, shards_num):
+            f.seek(size * k // shards_num)
+            f.readline()  # Move to the beginning of the next line
+            if offsets[-1] < f.tell() < size:
+                offsets.append(f.tell())
+    offsets.append(size)
+    # The lines of the last shard are not needed to know where any shard starts
+    lines_nums = list(starmap(count_lines, [(file_path, start, end) for start, end in zip(offsets[:-2], offsets[1:-1])]))
+    first_lines_idx = np.concatenate([[0], np.cumsum(lines_nums, dtype=np.int64)]).tolist()
+    return list(zip(offsets[:-1], offsets[1:], first_lines_idx))
+
+
+def read_lines_in_chunks(file_path, chunk_size, step=12, start=0, end=None, first_line_idx=0):
+    """Yield lists with at most chunk_size lines of file_path, from byte start to byte end.
+    Like split_database_txt_by_lat.py only one line every step is used, counting from the
+    beginning of the file, so first_line_idx is the index of the line at byte start.
+    """
+    with open(file_path, 'rb') as f:
+        f.seek(start)
+        position = start
+        line_idx = first_line_idx
+        chunk = []
+        for line in f:
+            if end is not None and position >= end:
+                break
+            position += len(line)
+            if line_idx % step == 0:
+                chunk.append(line.decode('utf-8').strip())
+                if len(chunk) == chunk_size:
+                    yield chunk
+                    chunk = []
+            line_idx += 1
+        if len(chunk) > 0:
+            yield chunk
+
+
+def parse_lines(lines):
+    """Return UTM east, UTM north and latitude band of each path."""
+    metadatas = [line.split('@', 3) for line in lines]
+    utm_east = np.array([m[1] for m in metadatas], dtype=np.float64)
+    utm_north = np.array([m[2] for m in metadatas], dtype=np.float64)
+    # The first field ends with the latitude, e.g. 37.75, followed by two characters
+    bands = np.array([int(m[0][:-2][-2:]) for m in metadatas], dtype=np.int64) - 70
+    return utm_east, utm_north, bands
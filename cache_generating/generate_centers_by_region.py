@@ -1,6 +1,5 @@
 import math
 import numpy as np
-from tqdm import tqdm
 import utm
 import os
 from time import time
@@ -13,22 +12,49 @@ UTM_NORTH_MIN = 4172649
 UTM_NORTH_MAX = 4184989
 START_CENTER = (int((UTM_EAST_MIN+UTM_EAST_MAX)/2), int((UTM_NORTH_MIN+UTM_NORTH_MAX)/2))  # Start from the center of the area
 RADIUS = 5
+SPACING = 4  # Distance between two neighbouring centers, in multiples of RADIUS * scale
 E = 5  # Tolerable errors
 
+# You can change the feature setting here
+SCALE_LIST = [1, 2]
+ORIENTATION_LIST = [0, 15]
+PHASE_SCALE = [0, 2]
+
 
 def utm_to_latlong(u, zone_number=10, zone_letter='S'):
     u = np.array(u)
-    if len(u.shape) > 1:
-        return np.array([utm_to_latlong(u_i, zone_number=zone_number, zone_letter=zone_letter) for u_i in u])
+    if len(u.shape) > 1:  # utm works on whole arrays, so convert all the points at once
+        return np.stack(utm.to_latlon(u[:, 0], u[:, 1], zone_number=zone_number, zone_letter=zone_letter), axis=1)
 
     easting, northing = u
     return utm.to_latlon(easting, northing, zone_number=zone_number, zone_letter=zone_letter)
 
 
-def rotate_and_translate(Position_A, Position_B, angle_degrees, translation):
+def get_latitude_regions(latitudes):
+    """Return the latitude truncated to two decimals (as an int, e.g. 3775 for 37.7512)
+    of each point, which is the vectorized version of str(latitude)[0:5].
+    """
+    latitudes = np.asarray(latitudes, dtype=np.float64)
+    hundredths = np.floor(latitudes * 100).astype(np.int64)
+    # Close to the border between two bands floor() may be fooled by floating point errors
+    borderline = np.flatnonzero(np.abs(latitudes * 100 - np.round(latitudes * 100)) < 1e-6)
+    hundredths[borderline] = [int(str(latitudes[i])[0:5].replace('.', '')) for i in borderline]
+    return hundredths
+
+
+def get_bands_idx(centers):
+    """Return the index of the latitude band of each center, e.g. 5 for a center at 37.7512.
+    Centers south of 37.70 have a negative index.
+    """
+    return get_latitude_regions(utm_to_latlong(centers)[:, 0]) % 100 - 70
 
+
+def rotate_and_translate(Position_A, Positions_B, angle_degrees, translation):
+    """Rotate all the points in Positions_B (an array of shape (num_points, 2)) around
+    Position_A, translate them and truncate them to integers.
+    """
     A_X, A_Y = Position_A
-    B_X, B_Y = Position_B
+    B_X, B_Y = Positions_B[:, 0], Positions_B[:, 1]
     translation_X, translation_Y = translation
 
     delta_x = B_X - A_X
@@ -42,60 +68,77 @@ def rotate_and_translate(Position_A, Position_B, angle_degrees, translation):
     B_X_prime = A_X + delta_x_prime
     B_Y_prime = A_Y + delta_y_prime
 
-    translation_matrix = np.array([[1, 0, translation_X], [0, 1, translation_Y], [0, 0, 1]])
-    center_transformed = np.dot(translation_matrix[:2, :2], (B_X_prime, B_Y_prime)) + translation_matrix[:2, 2]
+    center_transformed = np.stack([B_X_prime + translation_X, B_Y_prime + translation_Y], axis=1)
+
+    return np.trunc(center_transformed).astype(np.int64)
 
-    return tuple([int(x) for x in center_transformed])
 
+def get_lattice_steps(scale, spacing=SPACING):
+    """Return the horizontal and vertical distance between two neighbouring rows of the
+    hexagonal lattice, rounded to 2 decimals like all the coordinates of the lattice.
+    """
+    distance = spacing * RADIUS * scale
+    return round(distance * math.cos(math.radians(60)), 2), round(distance * math.sin(math.radians(60)), 2)
 
-def generate_hexagon(curr_center, scale, x_range=None, y_range=None, spacing=4):
+
+def generate_lattice(scale, x_range=None, y_range=None, spacing=SPACING):
+    """Return all the nodes of the hexagonal lattice that starts from START_CENTER and lies within
+    x_range and y_range, as two arrays with UTM east and north, row by row.
+    A node is START_CENTER + (i * step_x, j * step_y), with i + j even.
+    """
     if y_range is None:
         y_range = [UTM_NORTH_MIN - scale * RADIUS - E, UTM_NORTH_MAX + scale * RADIUS + E]
     if x_range is None:
         x_range = [UTM_EAST_MIN - scale * RADIUS - E, UTM_EAST_MAX + scale * RADIUS + E]
-    points = []
-    for i in range(6):
-        angle_rad = math.radians(60 * i)
-        x = round(curr_center[0] + spacing * math.cos(angle_rad) * RADIUS * scale, 2)
-        y = round(curr_center[1] + spacing * math.sin(angle_rad) * RADIUS * scale, 2)
-        if x_range[0] <= x <= x_range[1] and y_range[0] <= y <= y_range[1]:
-            new_center = (x, y)
-            points.append(new_center)
-    return points
+    # Work with integer hundredths of meter, so that coordinates are exactly rounded to 2 decimals
+    step_x, step_y = [round(step * 100) for step in get_lattice_steps(scale, spacing)]
+    start_x, start_y = START_CENTER[0] * 100, START_CENTER[1] * 100
+    i = np.arange(math.floor((x_range[0] * 100 - start_x) / step_x) - 1, math.ceil((x_range[1] * 100 - start_x) / step_x) + 2)
+    j = np.arange(math.floor((y_range[0] * 100 - start_y) / step_y) - 1, math.ceil((y_range[1] * 100 - start_y) / step_y) + 2)
+    i, j = np.meshgrid(i, j)
+    i, j = i[(i + j) % 2 == 0], j[(i + j) % 2 == 0]
+    x = (start_x + i * step_x) / 100
+    y = (start_y + j * step_y) / 100
+    within_range = (x_range[0] <= x) & (x <= x_range[1]) & (y_range[0] <= y) & (y <= y_range[1])
+    return x[within_range], y[within_range]
 
 
 def generate_centers_for_group(scale, orientation, phase):
-    storage = set()
-    storage.add(START_CENTER)
-    queue = [START_CENTER]
+    """Return the centers of a group as an array of shape (num_centers, 2) with integer UTM coordinates.
+    The position of a center within the array is its class index.
+    """
+    lattice = np.stack(generate_lattice(scale), axis=1)
+    centers_for_group = rotate_and_translate(START_CENTER, lattice, orientation, phase)
+
+    within_east = (UTM_EAST_MIN - scale * RADIUS < centers_for_group[:, 0]) & \
+                  (centers_for_group[:, 0] < UTM_EAST_MAX + scale * RADIUS)
+    within_north = (UTM_NORTH_MIN - scale * RADIUS < centers_for_group[:, 1]) & \
+                   (centers_for_group[:, 1] < UTM_NORTH_MAX + scale * RADIUS)
 
-    while queue:
-        current_center = queue.pop(0)
-        new_centers = generate_hexagon(current_center, scale)
-        for new_center in new_centers:
-            if new_center not in storage:
-                queue.append(new_center)
-                storage.add(new_center)
+    return centers_for_group[within_east & within_north]
 
-    centers_for_group = []
-    for center in storage:
-        centers_for_group.append(rotate_and_translate(START_CENTER, center, orientation, phase))
 
-    for center in centers_for_group.copy():
-        if center[0] <= UTM_EAST_MIN - scale * RADIUS or center[0] >= UTM_EAST_MAX + scale * RADIUS:
-            centers_for_group.remove(center)
-    for center in centers_for_group.copy():
-        if center[1] <= UTM_NORTH_MIN - scale * RADIUS or center[1] >= UTM_NORTH_MAX + scale * RADIUS:
-            centers_for_group.remove(center)
+def get_groups_features():
+    """Return the (scale, orientation, phase) of every group, in group_idx order."""
+    phase_list = []
+    for x in PHASE_SCALE:
+        for y in PHASE_SCALE:
+            phase_list.append([x * RADIUS, y * RADIUS])
 
-    return centers_for_group
+    groups_features = []
+    for scale in SCALE_LIST:
+        for orientation in ORIENTATION_LIST:
+            for phase in phase_list:
+                revision_phase = [phase[0]*scale, phase[1]*scale]
+                groups_features.append((scale, orientation, revision_phase))
+    return groups_features
 
 
 def save_to_txt(data, filename_prefix):
     for i, sublist in enumerate(data):
-        with open(f"{filename_prefix}_{i}.txt", "w") as f:
-            for item in tqdm(sublist):
-                f.write(f"{item[0]}, {item[1]}, {item[2]}, {item[3]}, {item[4]}, {item[5]}, {item[6]}\n")
+        # Each row is region, group_idx, element_idx, utm_east, utm_north, radius, radius_square,
+        # where the region (e.g. 37.75) is stored as its integer and decimal parts
+        np.savetxt(f"{filename_prefix}_{i}.txt", sublist, fmt="%d.%02d, %d, %d, %d, %d, %d, %d")
 
 
 if __name__ == '__main__':
@@ -103,43 +146,31 @@ if __name__ == '__main__':
     # Generating centers
     t0 = time()
     centers_groups = []
+    groups_features = get_groups_features()
 
-    # You can change the feature setting here
-    scale_list = [1, 2]
-    orientation_list = [0, 15]
-    phase_scale = [0, 2]
-    phase_list = []
-    for x in phase_scale:
-        for y in phase_scale:
-            phase_list.append([x * RADIUS, y * RADIUS])
-
-    for scale in scale_list:
-        for orientation in orientation_list:
-            for phase in phase_list:
-                revision_phase = [phase[0]*scale, phase[1]*scale]
-                centers_groups.append(generate_centers_for_group(scale, orientation, revision_phase))
-                now_time = time()
-                print('Complete a group of centers generation, taking a total of ' + str(round((now_time - t0), 2)) + 's.')
+    for scale, orientation, phase in groups_features:
+        centers_groups.append(generate_centers_for_group(scale, orientation, phase))
+        now_time = time()
+        print('Complete a group of centers generation, taking a total of ' + str(round((now_time - t0), 2)) + 's.')
 
     # Saving
     for group in centers_groups:
         print(len(group))
 
-    group_radius_square = [25, 25, 25, 25, 25, 25, 25, 25, 100, 100, 100, 100, 100, 100, 100, 100]
-    group_radius = [5, 5, 5, 5, 5, 5, 5, 5, 10, 10, 10, 10, 10, 10, 10, 10]
-
-    flattened_list = [[] for _ in range(13)]
-
-    for group_idx, group in enumerate(centers_groups):
-        for element_idx, element in enumerate(group):
-            latlong = utm_to_latlong(element)
-            region_idx = str(latlong[0])[0:5]
-            region_list_idx = int(region_idx[3:]) - 70
-            center = [region_idx, group_idx, element_idx]
-            center.extend(element)
-            center.append(group_radius[group_idx])
-            center.append(group_radius_square[group_idx])
-            flattened_list[region_list_idx].append(center)
+    rows = []
+    for group_idx, (group, (scale, _, _)) in enumerate(zip(centers_groups, groups_features)):
+        region_idx = get_latitude_regions(utm_to_latlong(group)[:, 0])
+        radius = scale * RADIUS
+        rows.append(np.column_stack([region_idx // 100, region_idx % 100,
+                                     np.full(len(group), group_idx), np.arange(len(group)), group,
+                                     np.full(len(group), radius), np.full(len(group), radius ** 2)]))
+    rows = np.concatenate(rows)
+    region_list_idx = rows[:, 1] - 70
+    bands_num = max(13, region_list_idx.max() + 1)
+    # Centers south of 37.70 have a negative index, and like with list indexing they go in the last file
+    region_list_idx[region_list_idx < 0] += bands_num
+
+    flattened_list = [rows[region_list_idx == i] for i in range(bands_num)]
 
     saving_folder_name = "group_centers_by_lat"
 
@@ -149,4 +180,4 @@ if __name__ == '__main__':
     else:
         print(f"Folder '{saving_folder_name}' already exists.")
 
-    save_to_txt(flattened_list, "group_centers_by_lat/group_centers")
\ No newline at end of file
+    save_to_txt(flattened_list, "group_centers_by_lat/group_centers")
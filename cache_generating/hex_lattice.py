@@ -0,0 +1,136 @@
+import os
+import math
+import numpy as np
+
+from generate_centers_by_region import START_CENTER, RADIUS, get_lattice_steps, get_groups_features
+
+
+class HexLatticeLabeler:
+    def __init__(self, centers, scale, orientation, phase, center_bands=None):
+        """Assign images to the classes of one group in O(1) per image.
+
+        The centers of a group lie (up to the int() rounding done by rotate_and_translate)
+        on a hexagonal lattice, fixed by the scale, orientation and phase of the group.
+        Instead of comparing each image with every center, we invert the rotation and
+        translation, find the nearest lattice node in closed form, and only check the
+        center of that node. Since the circles are much smaller than the lattice spacing,
+        this is the only center that can contain the image.
+
+        Parameters
+        ----------
+        centers : array of shape (num_centers, 2), UTM east and north of each center.
+            The position of a center in this array is its class index.
+        scale, orientation, phase : the features of the group, as in generate_centers_for_group.
+        center_bands : optional array with the latitude band of each center. If given,
+            label() can restrict each image to the centers of its own band.
+        """
+        self.centers = np.asarray(centers, dtype=np.float64).reshape(-1, 2)
+        self.radius = float(RADIUS * scale)
+        self.radius_square = self.radius ** 2
+        self.step_x, self.step_y = get_lattice_steps(scale)
+        angle_radians = math.radians(-1 * orientation)
+        self.cos, self.sin = math.cos(angle_radians), math.sin(angle_radians)
+        self.origin = (START_CENTER[0] + phase[0], START_CENTER[1] + phase[1])
+        self.center_bands = None if center_bands is None else np.asarray(center_bands, dtype=np.int64)
+
+        # Lookup table from lattice node to class index, -1 for nodes without a center
+        rows, cols = self.nearest_node(self.centers[:, 0], self.centers[:, 1])
+        if len(self.centers) == 0:
+            self.row_min, self.col_min = 0, 0
+            self.class_grid = np.full((0, 0), -1, dtype=np.int64)
+            return
+        self.row_min, self.col_min = rows.min(), cols.min()
+        self.class_grid = np.full((rows.max() - self.row_min + 1, cols.max() - self.col_min + 1), -1, dtype=np.int64)
+        self.class_grid[rows - self.row_min, cols - self.col_min] = np.arange(len(self.centers))
+        if np.count_nonzero(self.class_grid >= 0) != len(self.centers):
+            raise ValueError("Some centers do not lie on the lattice of the given scale, orientation and phase")
+
+    def nearest_node(self, utm_east, utm_north):
+        """Return the (row, col) of the lattice node nearest to each point.
+        Nodes are (i, j) pairs with i + j even, where i counts steps of step_x
+        and j rows of step_y; col is i // 2, which is unique within a row.
+        """
+        delta_x = np.asarray(utm_east, dtype=np.float64) - self.origin[0]
+        delta_y = np.asarray(utm_north, dtype=np.float64) - self.origin[1]
+        # Undo the rotation of rotate_and_translate
+        u = (delta_x * self.cos + delta_y * self.sin) / self.step_x
+        v = (-delta_x * self.sin + delta_y * self.cos) / self.step_y
+        # The lattice is the union of the (even, even) and the (odd, odd) rectangular lattices
+        i_even, j_even = 2 * np.round(u / 2), 2 * np.round(v / 2)
+        i_odd, j_odd = 2 * np.floor(u / 2) + 1, 2 * np.floor(v / 2) + 1
+        distance_even = ((u - i_even) * self.step_x) ** 2 + ((v - j_even) * self.step_y) ** 2
+        distance_odd = ((u - i_odd) * self.step_x) ** 2 + ((v - j_odd) * self.step_y) ** 2
+        use_odd = distance_odd < distance_even
+        i = np.where(use_odd, i_odd, i_even).astype(np.int64)
+        j = np.where(use_odd, j_odd, j_even).astype(np.int64)
+        return j, i // 2
+
+    def label(self, utm_east, utm_north, bands=None):
+        """Return the class index of each image within this group, or -1 if the image
+        does not fall within any circle. If bands is given (a scalar or one band per
+        image), only centers of the same latitude band are considered, which reproduces
+        the results of the per-band files of cal_group_and_classes_by_lat.py.
+        """
+        utm_east = np.asarray(utm_east, dtype=np.float64)
+        utm_north = np.asarray(utm_north, dtype=np.float64)
+        rows, cols = self.nearest_node(utm_east, utm_north)
+        rows, cols = rows - self.row_min, cols - self.col_min
+        in_grid = (rows >= 0) & (rows < self.class_grid.shape[0]) & (cols >= 0) & (cols < self.class_grid.shape[1])
+        classes = np.full(utm_east.shape, -1, dtype=np.int64)
+        classes[in_grid] = self.class_grid[rows[in_grid], cols[in_grid]]
+
+        has_center = classes >= 0
+        centers = self.centers[classes[has_center]]
+        # Same test as the brute force search over all centers
+        dx = np.abs(centers[:, 0] - utm_east[has_center])
+        dy = np.abs(centers[:, 1] - utm_north[has_center])
+        distance_squared = dx**2 + dy**2
+        within = (dy <= self.radius) & (dx <= self.radius) & (distance_squared <= self.radius_square)
+        if bands is not None and self.center_bands is not None:
+            bands = np.broadcast_to(np.asarray(bands, dtype=np.int64), utm_east.shape)
+            within &= self.center_bands[classes[has_center]] == bands[has_center]
+        classes[np.flatnonzero(has_center)[~within]] = -1
+        return classes
+
+
+def label_images(labelers, utm_east, utm_north, bands=None):
+    """Return the memberships of the images to the classes of all groups.
+
+    Returns
+    -------
+    images_idx, groups_idx, classes_idx : three arrays with one entry per membership,
+        sorted by image and then by group, like the rows of the group_info files.
+    """
+    classes = np.stack([labeler.label(utm_east, utm_north, bands) for labeler in labelers], axis=1)
+    images_idx, groups_idx = np.nonzero(classes >= 0)
+    return images_idx, groups_idx, classes[images_idx, groups_idx]
+
+
+def load_labelers(centers_folder="group_centers_by_lat", groups_features=None):
+    """Build one labeler per group from the files written by generate_centers_by_region.py.
+    The index of each file is used as the latitude band of its centers.
+    """
+    if groups_features is None:
+        groups_features = get_groups_features()
+    tables = []
+    band = 0
+    while os.path.exists(f"{centers_folder}/group_centers_{band}.txt"):
+        filename = f"{centers_folder}/group_centers_{band}.txt"
+        if os.path.getsize(filename) > 0:
+            # Each row is region, group_idx, element_idx, utm_east, utm_north, radius, radius_square
+            table = np.loadtxt(filename, delimiter=",", ndmin=2)
+            tables.append(np.column_stack([table[:, 1:5], np.full(len(table), band)]))
+        band += 1
+    if len(tables) == 0:
+        raise FileNotFoundError(f"There are no group centers within {centers_folder}")
+    table = np.concatenate(tables)
+
+    labelers = []
+    for group_idx, (scale, orientation, phase) in enumerate(groups_features):
+        group_table = table[table[:, 0] == group_idx]
+        group_table = group_table[np.argsort(group_table[:, 1])]
+        if not np.array_equal(group_table[:, 1], np.arange(len(group_table))):
+            raise ValueError(f"The centers of group {group_idx} within {centers_folder} are not contiguous")
+        labelers.append(HexLatticeLabeler(group_table[:, 2:4], scale, orientation, phase,
+                                          center_bands=group_table[:, 4]))
+    return labelers
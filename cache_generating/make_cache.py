@@ -8,6 +8,8 @@ from PIL import ImageFile
 from collections import defaultdict
 from tqdm import tqdm
 
+from database_paths import HEADINGS
+
 
 ImageFile.LOAD_TRUNCATED_IMAGES = True
 
@@ -27,7 +29,8 @@ logging.debug("Group together images belonging to the same class")
 images_per_class = defaultdict(list)
 
 group_id__class_id = []
-file_names = get_all_filenames('group_info_merge_name')
+# Read the bands in order, so that the cache does not depend on the order of os.listdir()
+file_names = sorted(get_all_filenames('group_info_merge_name'))
 for file_name in file_names:
     with open('group_info_merge_name/'+file_name, 'r') as f:
         lines = f.readlines()
@@ -42,17 +45,19 @@ for file_name in file_names:
                 group_id__class_id.append((group_id, class_id))
                 images_per_class[class_id].append(image_name)
 
+# Each path is used with all the HEADINGS, which count as different images
 images_per_class = {k: v for k, v in images_per_class.items() if
-                    len(v) >= min_images_per_class}
+                    len(v) * len(HEADINGS) >= min_images_per_class}
 
 group_id__class_id = set(group_id__class_id)
 
 logging.debug("Group together classes belonging to the same group")
-classes_per_group = defaultdict(set)
-for group_id, class_id in group_id__class_id:
+classes_per_group = defaultdict(list)
+# Sort groups and classes by their index, so that the cache is the same at every run
+for group_id, class_id in sorted(group_id__class_id, key=lambda g_c: (int(g_c[0]), int(g_c[1].split('_')[1]))):
     if class_id not in images_per_class:
         continue  # Skip classes with too few images
-    classes_per_group[group_id].add(class_id)
-classes_per_group = [list(c) for c in classes_per_group.values()]
+    classes_per_group[group_id].append(class_id)
+classes_per_group = list(classes_per_group.values())
 
-torch.save((classes_per_group, images_per_class), cachename)
\ No newline at end of file
+torch.save((classes_per_group, images_per_class, HEADINGS), cachename)
\ No newline at end of file
@@ -1,14 +1,8 @@
 import os
+import multiprocessing
 
 
-saving_folder_name = "group_info_merge_name"
-if not os.path.exists(saving_folder_name):
-    os.makedirs(saving_folder_name)
-    print(f"Folder '{saving_folder_name}' has been created successfully!")
-else:
-    print(f"Folder '{saving_folder_name}' already exists.")
-
-for i in range(70, 82):
+def merge_band(i):
     input_file = 'group_info/lat37.'+str(i)+'_group.txt'
     output_file = 'group_info_merge_name/lat37.'+str(i)+'.txt'
 
@@ -25,12 +19,22 @@ for i in range(70, 82):
             else:
                 keyword_dict[keyword] = [features]
 
+    # Each path is written once: its headings (database_paths.HEADINGS) are added by the dataset
     with open(output_file, 'w') as file:
         for keyword, features_list in keyword_dict.items():
-            orientations = [0, 1]
-            for ori in orientations:
-                temp_list = keyword.split('@')
-                temp_list[9] = str(ori*30)
-                keyword_change_orientation = '@'.join(temp_list)
-                output_line = keyword_change_orientation + ' ' + ' '.join(features_list) + '\n'
-                file.write(output_line)
+            output_line = keyword + ' ' + ' '.join(features_list) + '\n'
+            file.write(output_line)
+
+
+if __name__ == '__main__':
+
+    saving_folder_name = "group_info_merge_name"
+    if not os.path.exists(saving_folder_name):
+        os.makedirs(saving_folder_name)
+        print(f"Folder '{saving_folder_name}' has been created successfully!")
+    else:
+        print(f"Folder '{saving_folder_name}' already exists.")
+
+    # The bands are independent, so they are merged in parallel, each one in its own file
+    with multiprocessing.Pool(min(12, multiprocessing.cpu_count())) as pool:
+        pool.map(merge_band, range(70, 82))
@@ -0,0 +1,19 @@
+import time
+import resource
+from contextlib import contextmanager
+
+
+@contextmanager
+def report(stage_name, stats=None):
+    """Print the time taken by a stage and the peak memory so far of this process and of its
+    largest worker process (if any). If stats is a dict, also save them in stats[stage_name].
+    """
+    t0 = time.time()
+    yield
+    peak_memory_gb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024 ** 2
+    workers_peak_memory_gb = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024 ** 2
+    if stats is not None:
+        stats[stage_name] = {"seconds": time.time() - t0, "peak_memory_gb": peak_memory_gb,
+                             "workers_peak_memory_gb": workers_peak_memory_gb}
+    print(f"{stage_name} took {time.time() - t0:.1f}s, peak memory so far {peak_memory_gb:.2f} GB" +
+          (f" ({workers_peak_memory_gb:.2f} GB per worker)" if workers_peak_memory_gb > 0 else ""))
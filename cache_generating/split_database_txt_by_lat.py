@@ -1,50 +1,47 @@
-import numpy as np
-import tqdm
 import os
-
-
-def read_large_text_file(file_path):
-    lines = []
-    utm_east = []
-    utm_north = []
-    lat = []
-    with open(file_path, 'r', encoding='utf-8') as f:
-        for line in f:
-            string = line.strip()
-            lines.append(string)
-            temp = string.split('@')
-            lat.append(temp[0][:-2])
-            utm_east.append(float(temp[1]))
-            utm_north.append(float(temp[2]))
-    return np.array(lines), np.array(utm_east), np.array(utm_north), np.array(lat)
-
-
-# Reading and splitting
-file_path = 'database_images_paths.txt'  # Using the file you download from SF-XL dataset
-data_array, utm_east, utm_north, lat = read_large_text_file(file_path)
-
-data_merge = [[] for _ in range(12)]
-
-for i in range(12):
-    for j in tqdm.trange(0, len(data_array), 12):
-        if int(lat[j][-2:]) - 70 == i:
-            data_merge[i].append([lat[j], utm_east[j], utm_north[j], data_array[j]])
-
-
-# Saving
-def save_to_txt(data, filename_prefix):
-    for i, sublist in enumerate(data):
-        with open(f"{filename_prefix}_{i}.txt", "w") as f:
-            for item in tqdm.tqdm(sublist):
-                f.write(f"{item[0]}, {item[1]}, {item[2]}, {item[3]}\n")
-
-
-saving_folder_name = "path_by_lat"
-
-if not os.path.exists(saving_folder_name):
-    os.makedirs(saving_folder_name)
-    print(f"Folder '{saving_folder_name}' has been created successfully!")
-else:
-    print(f"Folder '{saving_folder_name}' already exists.")
-
-save_to_txt(data_merge, "path_by_lat/lat_")
\ No newline at end of file
+import argparse
+import numpy as np
+from tqdm import tqdm
+
+from database_paths import BANDS_NUM, read_lines_in_chunks
+
+
+def split_by_lat(file_path, filename_prefix, step=12, chunk_size=100_000, buffer_size=1024 ** 2):
+    """Read file_path once, in chunks of lines, and append each line to the file of its
+    latitude band, so that the memory does not grow with the size of file_path.
+    Only one line every step is used.
+    """
+    files = [open(f"{filename_prefix}_{i}.txt", "w", buffering=buffer_size) for i in range(BANDS_NUM)]
+    try:
+        for lines in tqdm(read_lines_in_chunks(file_path, chunk_size, step)):
+            metadatas = [line.split('@', 3) for line in lines]
+            lat = [m[0][:-2] for m in metadatas]
+            bands = np.array([l[-2:] for l in lat]).astype(np.int64) - 70
+            # Sort the lines by band, keeping their order, and write each band at once
+            order = np.argsort(bands, kind="stable")
+            bounds = np.searchsorted(bands[order], np.arange(BANDS_NUM + 1))
+            for i in range(BANDS_NUM):
+                files[i].writelines(f"{lat[j]}, {float(metadatas[j][1])}, {float(metadatas[j][2])}, {lines[j]}\n"
+                                    for j in order[bounds[i]:bounds[i + 1]])
+    finally:
+        for f in files:
+            f.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument("--file_path", type=str, default="database_images_paths.txt",
+                        help="file you download from SF-XL dataset, with one path per line")
+    parser.add_argument("--step", type=int, default=12, help="use one line every step")
+    parser.add_argument("--chunk_size", type=int, default=100_000, help="number of lines read at once")
+    args = parser.parse_args()
+
+    saving_folder_name = "path_by_lat"
+
+    if not os.path.exists(saving_folder_name):
+        os.makedirs(saving_folder_name)
+        print(f"Folder '{saving_folder_name}' has been created successfully!")
+    else:
+        print(f"Folder '{saving_folder_name}' already exists.")
+
+    split_by_lat(args.file_path, "path_by_lat/lat_", args.step, args.chunk_size)
@@ -0,0 +1,82 @@
+import argparse
+import numpy as np
+from tqdm import tqdm
+
+from generate_centers_by_region import UTM_EAST_MIN, UTM_EAST_MAX, UTM_NORTH_MIN, UTM_NORTH_MAX, utm_to_latlong
+
+
+CROPS_PER_PANORAMA = 12  # Each panorama is split in crops facing 0, 30, ..., 330 degrees
+PANORAMAS_PER_SPOT = 12  # On average, each spot is captured this many times over the years
+STREETS_SPACING = 100  # Meters between two parallel streets
+SPOTS_SPACING = 10  # Meters between two spots along a street
+NOISE = 3  # Meters of noise between the panoramas of the same spot
+
+
+def generate_spots(spots_num, rng, off_streets_ratio=0.1):
+    """Return UTM east and north of spots spread along a grid of streets,
+    like the ones of SF-XL, plus a few spots far from any street.
+    """
+    east = rng.uniform(UTM_EAST_MIN, UTM_EAST_MAX, spots_num)
+    north = rng.uniform(UTM_NORTH_MIN, UTM_NORTH_MAX, spots_num)
+    # Move each spot onto a street, half of them on east-west and half on north-south streets
+    on_streets = rng.random(spots_num) >= off_streets_ratio
+    east_west = rng.random(spots_num) < 0.5
+    snap = lambda x, spacing: np.round(x / spacing) * spacing
+    north = np.where(on_streets & east_west, snap(north, STREETS_SPACING), north)
+    east = np.where(on_streets & east_west, snap(east, SPOTS_SPACING), east)
+    east = np.where(on_streets & ~east_west, snap(east, STREETS_SPACING), east)
+    north = np.where(on_streets & ~east_west, snap(north, SPOTS_SPACING), north)
+    return east, north
+
+
+def generate_paths(images_num, seed=0, chunk_size=100_000):
+    """Yield lists with the paths of images_num synthetic images, formatted like the ones of SF-XL:
+    @-separated fields where field 0 ends with the latitude (e.g. 37.75) followed by two characters,
+    1 and 2 are UTM east and north, 3 and 4 the UTM zone, 5 and 6 latitude and longitude,
+    7 the panorama id, 9 the heading and 13 the date. The CROPS_PER_PANORAMA crops of each
+    panorama are consecutive, so that using one line every 12 gives one crop per panorama.
+    """
+    rng = np.random.default_rng(seed)
+    panoramas_num = -(-images_num // CROPS_PER_PANORAMA)
+    spots_east, spots_north = generate_spots(max(1, panoramas_num // PANORAMAS_PER_SPOT), rng)
+    panoramas_per_chunk = max(1, chunk_size // CROPS_PER_PANORAMA)
+    lines_num = 0
+    for first_panorama in range(0, panoramas_num, panoramas_per_chunk):
+        chunk_panoramas = min(panoramas_per_chunk, panoramas_num - first_panorama)
+        spots = rng.integers(0, len(spots_east), chunk_panoramas)
+        east = np.clip(spots_east[spots] + rng.uniform(-NOISE, NOISE, chunk_panoramas), UTM_EAST_MIN, UTM_EAST_MAX)
+        north = np.clip(spots_north[spots] + rng.uniform(-NOISE, NOISE, chunk_panoramas), UTM_NORTH_MIN, UTM_NORTH_MAX)
+        latlong = utm_to_latlong(np.stack([east, north], axis=1))
+        dates = rng.integers(2009, 2022, chunk_panoramas) * 100 + rng.integers(1, 13, chunk_panoramas)
+        lines = []
+        for k in range(chunk_panoramas):
+            lat, lon = latlong[k]
+            prefix = f"{lat:.6f}"[:7]
+            fields = f"{east[k]:010.2f}@{north[k]:010.2f}@10@S@{lat:.5f}@{lon:.5f}@pano{first_panorama + k:08d}"
+            for heading in range(0, 360, 360 // CROPS_PER_PANORAMA):
+                lines.append(f"{prefix}@{fields}@@{heading}@@@@{dates[k]}@@.jpg")
+        lines = lines[:images_num - lines_num]
+        lines_num += len(lines)
+        yield lines
+
+
+def write_paths(file_path, images_num, seed=0):
+    """Write the paths of images_num synthetic images to file_path, one per line,
+    like the database_images_paths.txt of SF-XL.
+    """
+    with open(file_path, "w", buffering=1024 ** 2) as file, tqdm(total=images_num, desc="Writing paths") as bar:
+        for lines in generate_paths(images_num, seed):
+            file.write("\n".join(lines) + "\n")
+            bar.update(len(lines))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument("--file_path", type=str, default="synthetic_images_paths.txt",
+                        help="where to write the paths, one per line")
+    parser.add_argument("--images_num", type=int, default=1_000_000, help="number of paths to generate")
+    parser.add_argument("--seed", type=int, default=0, help="_")
+    args = parser.parse_args()
+
+    write_paths(args.file_path, args.images_num, args.seed)
+    print(f"Paths of {args.images_num} images have been saved to: {args.file_path}")
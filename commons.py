@@ -25,6 +25,49 @@ class InfiniteDataLoader(torch.utils.data.DataLoader):
         return batch
 
 
+class GroupsBatchSampler(torch.utils.data.Sampler):
+    def __init__(self, groups_lens, groups_per_epoch, batch_size, iterations_per_epoch, seed=None):
+        """Yield the batches of all the epochs, as indexes of the ConcatDataset of the groups (TrainGroupsDataset),
+        so that a single DataLoader, whose workers are started only once, can be used for the whole
+        training, and its workers already prepare the batches of the next group at the end of an epoch.
+        In each epoch the classes of its group are shuffled, and split in batches dropping the last one,
+        like a DataLoader with shuffle=True and drop_last=True, and shuffled again when they run out.
+        
+        Args:
+            groups_lens (list[int]): the number of classes of each group.
+            groups_per_epoch (list[int]): the group to use in each epoch.
+            batch_size (int): the number of classes in each batch.
+            iterations_per_epoch (int): the number of batches of each epoch.
+            seed (int): seed of the shuffling, if None it is drawn from torch's random generator.
+        """
+        for group_num in set(groups_per_epoch):
+            if groups_lens[group_num] < batch_size:
+                raise ValueError(f"Group {group_num} has {groups_lens[group_num]} classes, "
+                                 f"which are not enough for a batch of {batch_size}")
+        self.groups_lens = groups_lens
+        self.groups_offsets = np.cumsum([0] + list(groups_lens[:-1])).tolist()
+        self.groups_per_epoch = groups_per_epoch
+        self.batch_size = batch_size
+        self.iterations_per_epoch = iterations_per_epoch
+        self.generator = torch.Generator()
+        self.generator.manual_seed(int(torch.randint(2 ** 62, [1])) if seed is None else seed)
+    
+    def __iter__(self):
+        for group_num in self.groups_per_epoch:
+            group_len, group_offset = self.groups_lens[group_num], self.groups_offsets[group_num]
+            batches_num = 0
+            while batches_num < self.iterations_per_epoch:
+                permutation = torch.randperm(group_len, generator=self.generator) + group_offset
+                for start in range(0, group_len - self.batch_size + 1, self.batch_size):
+                    yield permutation[start : start + self.batch_size].tolist()
+                    batches_num += 1
+                    if batches_num == self.iterations_per_epoch:
+                        break
+    
+    def __len__(self):
+        return len(self.groups_per_epoch) * self.iterations_per_epoch
+
+
 def make_deterministic(seed: int = 0):
     """Make results deterministic. If seed == -1, do not make deterministic.
         Running your script in a deterministic way might slow it down.
@@ -1,8 +1,11 @@
 
 import torch
 import logging
+import warnings
+import contextlib
 import torchvision
 from torch import nn
+from torch.utils.checkpoint import checkpoint
 from typing import Tuple
 
 from cosplace_model.layers import Flatten, L2Norm, GeM
@@ -26,17 +29,25 @@ CHANNELS_NUM_IN_LAST_CONV = {
 
 
 class GeoLocalizationNet(nn.Module):
-    def __init__(self, backbone : str, fc_output_dim : int, train_all_layers : bool = False):
+    def __init__(self, backbone : str, fc_output_dim : int, train_all_layers : bool = False,
+                 activation_checkpointing : bool = False, pretrained : bool = True):
         """Return a model for GeoLocalization.
         
         Args:
             backbone (str): which torchvision backbone to use. Must be VGG16 or a ResNet.
             fc_output_dim (int): the output dimension of the last fc layer, equivalent to the descriptors dimension.
             train_all_layers (bool): whether to freeze the first layers of the backbone during training or not.
+            activation_checkpointing (bool): whether to use activation checkpointing on the trainable stages
+                of the backbone during training, see forward_backbone_with_checkpointing().
+            pretrained (bool): whether to initialize the backbone with the ImageNet weights of torchvision,
+                which are downloaded if needed. Not needed when the weights of a trained model are loaded.
         """
         super().__init__()
         assert backbone in CHANNELS_NUM_IN_LAST_CONV, f"backbone must be one of {list(CHANNELS_NUM_IN_LAST_CONV.keys())}"
-        self.backbone, features_dim = get_backbone(backbone, train_all_layers)
+        assert not (activation_checkpointing and backbone == "VGG16"), \
+            "activation checkpointing is available only for the ResNets and the EfficientNets"
+        self.activation_checkpointing = activation_checkpointing
+        self.backbone, features_dim = get_backbone(backbone, train_all_layers, pretrained)
         self.aggregation = nn.Sequential(
             L2Norm(),
             GeM(),
@@ -46,9 +57,100 @@ class GeoLocalizationNet(nn.Module):
         )
     
     def forward(self, x):
-        x = self.backbone(x)
+        if self.activation_checkpointing and self.training and torch.is_grad_enabled():
+            x = self.forward_backbone_with_checkpointing(x)
+        else:
+            x = self.backbone(x)
         x = self.aggregation(x)
         return x
+    
+    def forward_backbone_with_checkpointing(self, x):
+        """Like self.backbone(x), but the activations within each trainable stage of the backbone
+        (layer3 and layer4 of the ResNets, blocks from 5 of the EfficientNets, unless all layers are
+        trained) are not kept for the backward, which computes them again from the input of the stage.
+        This needs much less memory, at the cost of running the forward of these stages twice.
+        """
+        # The blocks of the EfficientNets are within features, which is the first layer of the backbone
+        stages = self.backbone[0] if isinstance(self.backbone[0], nn.Sequential) else self.backbone
+        for stage in stages:
+            if isinstance(stage, nn.Sequential) and any(p.requires_grad for p in stage.parameters()):
+                x = checkpoint(recomputable(stage), x, use_reentrant=False)
+            else:
+                x = stage(x)
+        return x
+
+
+def recomputable(module):
+    """Return a function which runs module, for torch.utils.checkpoint: when it is run again to
+    recompute the activations, the running statistics of the batch norms are not updated a second time.
+    """
+    calls_num = 0
+    def run_module(x):
+        nonlocal calls_num
+        calls_num += 1
+        if calls_num == 1:
+            return module(x)
+        with frozen_batch_norm_statistics(module):
+            return module(x)
+    return run_module
+
+
+@contextlib.contextmanager
+def frozen_batch_norm_statistics(module):
+    batch_norms = [m for m in module.modules() if isinstance(m, nn.modules.batchnorm._BatchNorm)
+                   and m.training and m.track_running_stats]
+    states = [(m.momentum, m.num_batches_tracked.clone()) for m in batch_norms]
+    # With momentum 0, the running statistics are left as they are
+    for m in batch_norms:
+        m.momentum = 0.0
+    try:
+        yield
+    finally:
+        for m, (momentum, num_batches_tracked) in zip(batch_norms, states):
+            m.momentum = momentum
+            m.num_batches_tracked.copy_(num_batches_tracked)
+
+
+# How to run the model for inference, see InferenceNet
+INFERENCE_BACKENDS = ["eager", "channels_last", "compile", "torchscript"]
+
+
+class InferenceNet(nn.Module):
+    def __init__(self, model : GeoLocalizationNet, backend : str = "channels_last"):
+        """Wrap a model to compute descriptors faster, e.g. to index a database. Note that the
+        model is modified in place, so it should not be trained afterwards.
+        
+        Args:
+            model (GeoLocalizationNet): the model, which is put in eval mode and in channels-last
+                memory format, which is faster for convolutions on both CPU and GPU.
+            backend (str): one of
+                "channels_last" : run the model under torch.inference_mode, with channels-last inputs.
+                "compile" : as "channels_last", with the model compiled by torch.compile, which also
+                    fuses the aggregation (L2Norm, GeM, Flatten, Linear, L2Norm) into a few kernels.
+                "torchscript" : as "channels_last", with the model traced at the first call, frozen and
+                    optimized with torch.jit.optimize_for_inference (e.g. batch norms folded into the convs).
+        """
+        super().__init__()
+        assert backend in INFERENCE_BACKENDS[1:], f"backend must be one of {INFERENCE_BACKENDS[1:]}"
+        self.backend = backend
+        self.model = model.eval().to(memory_format=torch.channels_last)
+        self.compiled_model = torch.compile(self.model, dynamic=True) if backend == "compile" else None
+        self.traced_model = None
+    
+    def forward(self, x):
+        x = x.contiguous(memory_format=torch.channels_last)
+        if self.backend == "torchscript" and self.traced_model is None:
+            # Tracing does not work within inference_mode. The warnings are about the shape
+            # checks of the model (e.g. in Flatten), which are only evaluated while tracing
+            with torch.no_grad(), warnings.catch_warnings():
+                warnings.simplefilter("ignore", torch.jit.TracerWarning)
+                self.traced_model = torch.jit.optimize_for_inference(torch.jit.trace(self.model, x))
+        with torch.inference_mode():
+            if self.backend == "compile":
+                return self.compiled_model(x)
+            if self.backend == "torchscript":
+                return self.traced_model(x)
+            return self.model(x)
 
 
 def get_pretrained_torchvision_model(backbone_name : str) -> torch.nn.Module:
@@ -63,8 +165,11 @@ def get_pretrained_torchvision_model(backbone_name : str) -> torch.nn.Module:
     return model
 
 
-def get_backbone(backbone_name : str, train_all_layers : bool) -> Tuple[torch.nn.Module, int]:
-    backbone = get_pretrained_torchvision_model(backbone_name)
+def get_backbone(backbone_name : str, train_all_layers : bool, pretrained : bool = True) -> Tuple[torch.nn.Module, int]:
+    if pretrained:
+        backbone = get_pretrained_torchvision_model(backbone_name)
+    else:
+        backbone = getattr(torchvision.models, backbone_name.lower())()
     if backbone_name.startswith("ResNet"):
         if train_all_layers:
             logging.debug(f"Train all layers of the {backbone_name}")
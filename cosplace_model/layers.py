@@ -5,8 +5,48 @@ import torch.nn.functional as F
 from torch.nn.parameter import Parameter
 
 
-def gem(x, p=torch.ones(1)*3, eps: float = 1e-6):
-    return F.avg_pool2d(x.clamp(min=eps).pow(p), (x.size(-2), x.size(-1))).pow(1./p)
+def gem_forward(x, p, eps: float = 1e-6):
+    # The clamped tensor is a copy of x, so the power is computed in place. If p is an int (e.g. 3)
+    # the power is computed with multiplications, which is much faster than with a generic exponent
+    return x.clamp(min=eps).pow_(p).mean(dim=(-2, -1), keepdim=True).pow(1./p)
+
+
+class GeMFunction(torch.autograd.Function):
+    """GeM with a custom backward, which saves only its input and output, instead of the
+    clamped and powered feature maps, and recomputes what it needs from them."""
+    @staticmethod
+    def forward(ctx, x, p, eps):
+        y = gem_forward(x, p, eps)
+        ctx.eps = eps
+        ctx.p = p
+        ctx.save_for_backward(x, y, *([p] if isinstance(p, torch.Tensor) else []))
+        return y
+    
+    @staticmethod
+    def backward(ctx, grad_output):
+        x, y = ctx.saved_tensors[:2]
+        p = ctx.saved_tensors[2] if isinstance(ctx.p, torch.Tensor) else ctx.p
+        x_clamped = x.clamp(min=ctx.eps)
+        # With m = mean(x^p) and y = m^(1/p), dy/dx = (x / y)^(p-1) / (H * W)
+        ratio = x_clamped.div_(y)
+        grad_x = grad_p = None
+        if ctx.needs_input_grad[0]:
+            grad_x = ratio.pow(p - 1).mul_(grad_output / (x.shape[-2] * x.shape[-1]))
+            grad_x.masked_fill_(x < ctx.eps, 0)  # Like the gradient of clamp
+        if ctx.needs_input_grad[1]:
+            # dy/dp = y / p * (mean((x / y)^p * log(x)) - log(y))
+            mean_log = (ratio.pow(p) * x.clamp(min=ctx.eps).log_()).mean(dim=(-2, -1), keepdim=True)
+            grad_p = (grad_output * y / p * (mean_log - y.log())).sum().reshape(p.shape)
+        return grad_x, grad_p, None
+
+
+def gem(x, p=3, eps: float = 1e-6):
+    """Generalized mean pooling over H and W, (mean(x.clamp(min=eps)^p))^(1/p).
+    p can be a number, or a tensor with one element (e.g. a Parameter which is being trained).
+    """
+    if torch.is_grad_enabled() and (x.requires_grad or (isinstance(p, torch.Tensor) and p.requires_grad)):
+        return GeMFunction.apply(x, p, eps)
+    return gem_forward(x, p, eps)
 
 
 class GeM(nn.Module):
@@ -14,9 +54,27 @@ class GeM(nn.Module):
         super().__init__()
         self.p = Parameter(torch.ones(1)*p)
         self.eps = eps
+        self.cached_p = None  # (storage and version of self.p, value of self.p as a number)
+    
+    def get_p_number(self):
+        """Return p as a number (an int if it is one). It is read from the device only when p has
+        changed since the last call (e.g. after an optimizer step, load_state_dict() or to()),
+        so frozen models and models in eval mode don't synchronize with the device at every forward.
+        """
+        key = (self.p.data_ptr(), self.p._version)
+        if self.cached_p is None or self.cached_p[0] != key:
+            p = self.p.item()
+            self.cached_p = (key, int(p) if p.is_integer() else p)
+        return self.cached_p[1]
     
     def forward(self, x):
-        return gem(x, p=self.p, eps=self.eps)
+        p = self.p
+        is_compiling = getattr(torch, "compiler", None) is not None and torch.compiler.is_compiling()
+        if not (torch.is_grad_enabled() and self.p.requires_grad) and not is_compiling:
+            # p is not being trained, so it can be used as a number.
+            # Within torch.compile p stays a tensor, as the whole pooling is fused anyway
+            p = self.get_p_number()
+        return gem(x, p=p, eps=self.eps)
     
     def __repr__(self):
         return f"{self.__class__.__name__}(p={self.p.data.tolist()[0]:.4f}, eps={self.eps})"
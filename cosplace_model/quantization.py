@@ -0,0 +1,52 @@
+
+import copy
+import contextlib
+import torch
+import warnings
+from torch import nn
+from torch.ao.quantization import get_default_qconfig_mapping, quantize_dynamic
+from torch.ao.quantization.quantize_fx import prepare_fx, convert_fx
+
+from cosplace_model import cosplace_network
+
+
+@contextlib.contextmanager
+def quantization_warnings_ignored():
+    """Hide the deprecation warnings of torch.ao.quantization, and its warnings about the
+    observers, which are raised for every layer and would flood the logs.
+    """
+    with warnings.catch_warnings():
+        warnings.filterwarnings("ignore", category=DeprecationWarning, module=r"torch\.ao")
+        warnings.filterwarnings("ignore", category=UserWarning, module=r"torch\.ao")
+        warnings.filterwarnings("ignore", message=r".*quantized tensor creation functions.*")
+        yield
+
+
+def quantize_model(model, calibration_batches):
+    """Return an int8 copy of the float model, which runs on CPU. The backbone is quantized
+    statically: its activations are quantized with ranges observed while running the model on
+    calibration_batches (an iterable of batches of normalized images), which should be a few
+    hundred images from the same domain of the test images. The final nn.Linear is quantized
+    dynamically, i.e. its weights are int8 and its input is quantized on the fly.
+    The aggregation (GeM and L2 normalizations) is kept in float32.
+    """
+    model = copy.deepcopy(model).cpu().eval()
+    with quantization_warnings_ignored():
+        model.backbone = prepare_fx(model.backbone, get_default_qconfig_mapping(torch.backends.quantized.engine),
+                                    example_inputs=(torch.zeros(1, 3, 224, 224),))
+        with torch.no_grad():
+            for images in calibration_batches:
+                model(images.cpu())
+        model.backbone = convert_fx(model.backbone)
+        model.aggregation = quantize_dynamic(model.aggregation, {nn.Linear}, dtype=torch.qint8)
+    return model
+
+
+def get_quantized_model(backbone : str, fc_output_dim : int) -> nn.Module:
+    """Return an int8 model with the same structure that quantize_model() returns, where to
+    load the state_dict of a quantized model, e.g. saved by quantize.py.
+    """
+    # All the weights and the quantization parameters are set by load_state_dict(), so there is
+    # no need to download the pretrained weights of the backbone, nor to calibrate
+    model = cosplace_network.GeoLocalizationNet(backbone, fc_output_dim, pretrained=False)
+    return quantize_model(model, calibration_batches=[])
@@ -0,0 +1,118 @@
+import os
+import numpy as np
+
+
+# Arrays of a compact cache, each one saved in the cache folder as {name}.npy
+ARRAYS_NAMES = ["paths", "paths_offsets", "images", "classes_offsets", "groups_offsets"]
+
+
+def save_compact_cache(classes_per_group, images_per_class, folder, headings=None):
+    """Save the cache in a columnar format, which can be memory-mapped by CompactCache.
+
+    Parameters
+    ----------
+    classes_per_group : list[list], the class_ids of each group, as in the pickled caches.
+    images_per_class : dict, the list of paths of each class_id, as in the pickled caches.
+    folder : str, where to save the arrays:
+        paths : uint8, all the paths encoded in UTF-8 and concatenated, each path only once.
+        paths_offsets : int64, path i is paths[paths_offsets[i]:paths_offsets[i+1]].
+        images : int32, the indexes of the paths of all classes, class after class.
+        classes_offsets : int64, class c has images[classes_offsets[c]:classes_offsets[c+1]].
+        groups_offsets : int64, group g has classes groups_offsets[g] to groups_offsets[g+1] - 1.
+        headings : int64, only saved if headings is given, see TrainDataset.
+    headings : list[int], the headings with which each path is used, as in the pickled caches.
+    """
+    paths_idx = {}
+    images = []
+    classes_offsets = [0]
+    groups_offsets = [0]
+    for classes_ids in classes_per_group:
+        for class_id in classes_ids:
+            for path in images_per_class[class_id]:
+                images.append(paths_idx.setdefault(path, len(paths_idx)))
+            classes_offsets.append(len(images))
+        groups_offsets.append(len(classes_offsets) - 1)
+
+    encoded_paths = [path.encode("utf-8") for path in paths_idx]
+    paths_offsets = np.zeros(len(encoded_paths) + 1, dtype=np.int64)
+    paths_offsets[1:] = np.cumsum([len(p) for p in encoded_paths])
+    arrays = {
+        "paths": np.frombuffer(b"".join(encoded_paths), dtype=np.uint8),
+        "paths_offsets": paths_offsets,
+        "images": np.array(images, dtype=np.int32),
+        "classes_offsets": np.array(classes_offsets, dtype=np.int64),
+        "groups_offsets": np.array(groups_offsets, dtype=np.int64),
+    }
+    os.makedirs(folder, exist_ok=True)
+    for name in ARRAYS_NAMES:
+        np.save(os.path.join(folder, f"{name}.npy"), arrays[name])
+    if headings is not None:
+        np.save(os.path.join(folder, "headings.npy"), np.array(headings, dtype=np.int64))
+
+
+class CompactCache:
+    def __init__(self, folder):
+        """Read-only view of a cache saved by save_compact_cache().
+        The arrays are memory-mapped, so the pages are shared by all the processes
+        (e.g. the DataLoader workers) instead of being copied in each of them.
+        """
+        self.folder = folder
+        for name in ARRAYS_NAMES:
+            setattr(self, name, np.load(os.path.join(folder, f"{name}.npy"), mmap_mode="r"))
+        headings_path = os.path.join(folder, "headings.npy")
+        self.headings = np.load(headings_path).tolist() if os.path.exists(headings_path) else None
+
+    def __getstate__(self):
+        # Only pickle the folder, so that processes started with spawn map the files again
+        return {"folder": self.folder}
+
+    def __setstate__(self, state):
+        self.__init__(state["folder"])
+
+    @property
+    def groups_num(self):
+        return len(self.groups_offsets) - 1
+
+    def get_classes_num(self, group_num):
+        return int(self.groups_offsets[group_num + 1] - self.groups_offsets[group_num])
+
+    def get_images_num(self, group_num):
+        """Return the number of images within a group, counting each path once per heading."""
+        first_class = self.groups_offsets[group_num]
+        last_class = self.groups_offsets[group_num + 1]
+        paths_num = int(self.classes_offsets[last_class] - self.classes_offsets[first_class])
+        return paths_num if self.headings is None else paths_num * len(self.headings)
+
+    def get_class_images(self, group_num, class_num):
+        """Return the indexes of the paths of the images of a class."""
+        class_idx = self.groups_offsets[group_num] + class_num
+        return self.images[self.classes_offsets[class_idx]:self.classes_offsets[class_idx + 1]]
+
+    def get_path(self, path_idx):
+        return bytes(self.paths[self.paths_offsets[path_idx]:self.paths_offsets[path_idx + 1]]).decode("utf-8")
+
+    def get_class_paths(self, group_num, class_num):
+        return [self.get_path(path_idx) for path_idx in self.get_class_images(group_num, class_num)]
+
+    def get_random_images(self, group_num, classes_nums):
+        """Return the index of the path of a random image of each class, picked all at once."""
+        classes_idx = self.groups_offsets[group_num] + np.asarray(classes_nums, dtype=np.int64)
+        starts = self.classes_offsets[classes_idx]
+        ends = self.classes_offsets[classes_idx + 1]
+        return self.images[starts + (np.random.random(len(classes_idx)) * (ends - starts)).astype(np.int64)]
+
+    def get_random_paths(self, group_num, classes_nums):
+        """Return the path of a random image of each class."""
+        return [self.get_path(path_idx) for path_idx in self.get_random_images(group_num, classes_nums)]
+
+
+if __name__ == "__main__":
+    """Convert a pickled cache (made with torch.save) to the compact format, for example
+    python -m datasets.compact_cache cache/database.torch cache/database_compact
+    """
+    import sys
+    import torch
+    # The caches made by cache_generating also contain the headings
+    classes_per_group, images_per_class, *headings = torch.load(sys.argv[1])
+    save_compact_cache(classes_per_group, images_per_class, sys.argv[2], *headings)
+    print(f"Compact cache has been saved to: {sys.argv[2]}")
@@ -1,8 +1,13 @@
 
 import os
+import hashlib
 import logging
-from glob import glob
+import torchvision
+from PIL import Image
 from PIL import ImageFile
+import torchvision.transforms as T
+
+from datasets.path_index import index_images_paths
 
 ImageFile.LOAD_TRUNCATED_IMAGES = True
 
@@ -10,8 +15,10 @@ ImageFile.LOAD_TRUNCATED_IMAGES = True
 def read_images_paths(dataset_folder, get_abs_path=False):
     """Find images within 'dataset_folder' and return their relative paths as a list.
     If there is a file 'dataset_folder'_images_paths.txt, read paths from such file.
-    Otherwise, use glob(). Keeping the paths in the file speeds up computation,
-    because using glob over large folders can be slow.
+    Otherwise, list the folder with index_images_paths(), which saves an index of the
+    folder in 'dataset_folder'_images_index.npz, so that later runs only list again
+    the directories which changed. Keeping the paths in the file speeds up computation,
+    because listing large folders can be slow.
     
     Parameters
     ----------
@@ -39,8 +46,8 @@ def read_images_paths(dataset_folder, get_abs_path=False):
                                     f"does not exist within {dataset_folder}. It is likely "
                                     f"that the content of {file_with_paths} is wrong.")
     else:
-        logging.debug(f"Searching images in {dataset_folder} with glob()")
-        images_paths = sorted(glob(f"{dataset_folder}/**/*.jpg", recursive=True))
+        logging.debug(f"Searching images in {dataset_folder} with index_images_paths()")
+        images_paths = index_images_paths(dataset_folder)
         if len(images_paths) == 0:
             raise FileNotFoundError(f"Directory {dataset_folder} does not contain any JPEG images")
     
@@ -49,3 +56,57 @@ def read_images_paths(dataset_folder, get_abs_path=False):
     
     return images_paths
 
+
+def get_fingerprint(images_paths):
+    """Return a short hash of the list of images, used to name the caches."""
+    sha1 = hashlib.sha1()
+    for i in range(0, len(images_paths), 100_000):
+        sha1.update(("\n".join(images_paths[i:i + 100_000]) + "\n").encode())
+    return sha1.hexdigest()[:16]
+
+
+def change_heading(path, heading):
+    """Return the path of the crop of the same panorama with the given heading."""
+    fields = path.split("@")
+    fields[9] = str(heading)  # field 9 is heading
+    return "@".join(fields)
+
+
+def open_image(path, decode_backend="pil", min_size=None):
+    """Open an image and return it as a uint8 tensor with shape [3, H, W].
+    
+    Parameters
+    ----------
+    path : str, path of the image
+    decode_backend : str, one of
+        "pil" : decode with PIL.
+        "pil_draft" : decode with PIL, but let libjpeg decode JPEGs directly at 1/2, 1/4 or 1/8
+            of their size (with PIL's draft()) as long as both sides stay >= min_size, which is
+            much cheaper than decoding them at full size and resizing them afterwards.
+        "torchvision" : decode with torchvision.io, which uses libjpeg-turbo and decodes
+            straight into a tensor.
+    min_size : int, minimum size of the sides of the decoded image, only used by "pil_draft".
+    
+    Returns
+    -------
+    image : torch.Tensor, uint8 with shape [3, H, W]
+    """
+    if decode_backend == "torchvision":
+        try:
+            return torchvision.io.decode_image(torchvision.io.read_file(path), mode=torchvision.io.ImageReadMode.RGB)
+        except RuntimeError:
+            pass  # For example truncated images, which PIL can still open
+    pil_image = Image.open(path)
+    if decode_backend == "pil_draft" and min_size is not None:
+        pil_image.draft("RGB", (min_size, min_size))
+    return T.functional.pil_to_tensor(pil_image.convert("RGB"))
+
+
+def get_decoded_size(size, decode_backend="pil", min_size=None):
+    """Return the size of a side of size pixels of a JPEG once decoded by open_image()."""
+    if decode_backend != "pil_draft" or min_size is None:
+        return size
+    scale = 1
+    while scale < 8 and size // (scale * 2) >= min_size:
+        scale *= 2
+    return -(-size // scale)
@@ -0,0 +1,122 @@
+import os
+import logging
+import multiprocessing
+import numpy as np
+from PIL import Image
+from PIL import ImageFile
+from tqdm import tqdm
+
+from datasets.dataset_utils import change_heading
+from datasets.compact_cache import CompactCache, save_compact_cache
+
+
+ImageFile.LOAD_TRUNCATED_IMAGES = True
+
+IMAGE_SHAPE = (3, 512, 512)  # Shape of the training images, see TrainDataset.__getitem__
+
+
+def decode_image(image_path):
+    image = np.asarray(Image.open(image_path).convert("RGB")).transpose(2, 0, 1)
+    if image.shape != IMAGE_SHAPE:
+        raise ValueError(f"Image {image_path} should have shape {list(IMAGE_SHAPE)} but has {list(image.shape)}.")
+    return image
+
+
+def pack_images(cache, dataset_folder, folder, shard_size_gb=4, num_workers=1):
+    """Decode the training images once and save them, together with the classes of the cache,
+    so that they can be read by ImageShards without opening and decoding any JPEG.
+
+    The classes are saved with save_compact_cache(), where each path has its heading already set
+    (so the same panorama with two headings counts as two images), and each path is stored once
+    even if it belongs to classes of many groups. Image i is the decoded image of path i, and the
+    images are saved as uint8 arrays of shape [3, 512, 512] in the order in which their classes
+    are listed, i.e. class after class, within shard_{k}.npy files of about shard_size_gb GB each.
+    Note that a decoded image takes about 15 times the space of its JPEG.
+
+    Parameters
+    ----------
+    cache : the cache of TrainDataset, e.g. from TrainDataset.get_cache().
+    dataset_folder : str, the path of the folder with the train images.
+    folder : str, where to save the shards and the classes:
+        shard_{k}.npy : uint8, with shape [images_num_of_shard_k, 3, 512, 512].
+        shards_offsets : int64, shard k has images shards_offsets[k] to shards_offsets[k+1] - 1.
+    shard_size_gb : float, size of each shard.
+    num_workers : int, number of processes used to decode the images.
+    """
+    classes_per_group = []
+    images_per_class = {}
+    for group_num in range(cache.groups_num):
+        classes_per_group.append([])
+        for class_num in range(cache.get_classes_num(group_num)):
+            paths = cache.get_class_paths(group_num, class_num)
+            if cache.headings is not None:
+                paths = [change_heading(path, heading) for path in paths for heading in cache.headings]
+            classes_per_group[-1].append((group_num, class_num))
+            images_per_class[(group_num, class_num)] = paths
+    save_compact_cache(classes_per_group, images_per_class, folder)
+    del classes_per_group, images_per_class
+
+    classes = CompactCache(folder)
+    images_num = len(classes.paths_offsets) - 1
+    images_per_shard = max(1, int(shard_size_gb * 1024 ** 3) // int(np.prod(IMAGE_SHAPE)))
+    shards_offsets = np.array(list(range(0, images_num, images_per_shard)) + [images_num], dtype=np.int64)
+    logging.info(f"Packing {images_num} images in {len(shards_offsets) - 1} shards within {folder}")
+
+    images_paths = (os.path.join(dataset_folder, classes.get_path(i)) for i in range(images_num))
+    pool = multiprocessing.Pool(num_workers) if num_workers > 1 else None
+    try:
+        images = pool.imap(decode_image, images_paths, chunksize=16) if pool else map(decode_image, images_paths)
+        with tqdm(total=images_num, desc="Packing images") as bar:
+            for shard_num, (start, end) in enumerate(zip(shards_offsets[:-1].tolist(), shards_offsets[1:].tolist())):
+                shard = np.lib.format.open_memmap(os.path.join(folder, f"shard_{shard_num}.npy"), mode="w+",
+                                                  dtype=np.uint8, shape=(end - start, *IMAGE_SHAPE))
+                for i in range(end - start):
+                    shard[i] = next(images)
+                    bar.update(1)
+                shard.flush()
+                del shard
+    finally:
+        if pool is not None:
+            pool.terminate()
+    # Saved last, as it marks the folder as complete
+    np.save(os.path.join(folder, "shards_offsets.npy"), shards_offsets)
+
+
+class ImageShards(CompactCache):
+    def __init__(self, folder):
+        """Compact cache of a folder made with pack_images(), which also has the decoded images.
+        The shards are memory-mapped, so reading an image is a copy from the page cache.
+        """
+        super().__init__(folder)
+        self.shards_offsets = np.load(os.path.join(folder, "shards_offsets.npy"))
+        self.shards = [np.load(os.path.join(folder, f"shard_{k}.npy"), mmap_mode="r")
+                       for k in range(len(self.shards_offsets) - 1)]
+
+    def get_image(self, image_idx):
+        """Return the decoded image as a read-only uint8 array with shape [3, 512, 512]."""
+        shard_num = np.searchsorted(self.shards_offsets, image_idx, side="right") - 1
+        return self.shards[shard_num][image_idx - self.shards_offsets[shard_num]]
+
+
+if __name__ == "__main__":
+    """Pack the images of a cache in shards, for example
+    python -m datasets.image_shards --cache_filename cache/database.torch --dataset_folder /root/database --output_folder cache/database_shards
+    Then use the output folder as --cache_filename for training.
+    """
+    import argparse
+    from datasets.train_cache import load_train_cache
+    parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument("--cache_filename", type=str, required=True,
+                        help="cache of the training set, made with torch.save or with datasets/compact_cache.py")
+    parser.add_argument("--dataset_folder", type=str, required=True,
+                        help="path of the folder with training images")
+    parser.add_argument("--output_folder", type=str, required=True, help="where to save the shards")
+    parser.add_argument("--shard_size_gb", type=float, default=4, help="_")
+    parser.add_argument("--num_workers", type=int, default=multiprocessing.cpu_count(),
+                        help="number of processes used to decode the images")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    pack_images(load_train_cache(args.cache_filename), args.dataset_folder, args.output_folder,
+                args.shard_size_gb, args.num_workers)
+    print(f"Shards have been saved to: {args.output_folder}")
@@ -0,0 +1,116 @@
+import os
+import logging
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+
+
+def encode_names(names):
+    """Encode a list of file names as a uint8 array, separated by NUL (which can't be within a name)."""
+    return np.frombuffer(b"\0".join(os.fsencode(n) for n in names), dtype=np.uint8)
+
+
+def decode_names(array, names_num):
+    if names_num == 0:
+        return []
+    return [os.fsdecode(n) for n in array.tobytes().split(b"\0")]
+
+
+def save_index(index, index_path):
+    """Save the index as a npz file: for each directory (relative to the dataset folder) its
+    mtime in nanoseconds, and the names of its images and of its subdirectories.
+    """
+    dirs = list(index)
+    arrays = {
+        "dirs": encode_names(dirs),
+        "dirs_mtimes": np.array([index[d][0] for d in dirs], dtype=np.int64),
+        "files_counts": np.array([len(index[d][1]) for d in dirs], dtype=np.int64),
+        "files": encode_names([f for d in dirs for f in index[d][1]]),
+        "subdirs_counts": np.array([len(index[d][2]) for d in dirs], dtype=np.int64),
+        "subdirs": encode_names([s for d in dirs for s in index[d][2]]),
+    }
+    # Write to a temporary file first, so that an interrupted run does not leave a broken index
+    with open(index_path + ".tmp", "wb") as file:
+        np.savez(file, **arrays)
+    os.replace(index_path + ".tmp", index_path)
+
+
+def load_index(index_path):
+    """Return the index saved by save_index(), as a dict {dir: (mtime, files, subdirs)}."""
+    with np.load(index_path) as arrays:
+        dirs_mtimes = arrays["dirs_mtimes"].tolist()
+        dirs = decode_names(arrays["dirs"], len(dirs_mtimes))
+        files_counts = arrays["files_counts"].tolist()
+        subdirs_counts = arrays["subdirs_counts"].tolist()
+        files = decode_names(arrays["files"], sum(files_counts))
+        subdirs = decode_names(arrays["subdirs"], sum(subdirs_counts))
+    index = {}
+    files_start = subdirs_start = 0
+    for d, mtime, files_count, subdirs_count in zip(dirs, dirs_mtimes, files_counts, subdirs_counts):
+        index[d] = (mtime, files[files_start : files_start + files_count],
+                    subdirs[subdirs_start : subdirs_start + subdirs_count])
+        files_start += files_count
+        subdirs_start += subdirs_count
+    return index
+
+
+def scan_dir(dataset_folder, rel_dir, cached_entry):
+    """Return (mtime, files, subdirs) of a directory, where files are the names of its JPEG images.
+    If the mtime of the directory is the same as in cached_entry, its content has not changed
+    (any file or directory created, deleted or renamed within it changes its mtime), so it
+    is not listed again. Like glob(), names starting with a dot are ignored.
+    """
+    dir_path = os.path.join(dataset_folder, rel_dir)
+    mtime = os.stat(dir_path).st_mtime_ns
+    if cached_entry is not None and cached_entry[0] == mtime:
+        return cached_entry
+    files, subdirs = [], []
+    with os.scandir(dir_path) as entries:
+        for entry in entries:
+            if entry.name.startswith("."):
+                continue
+            if entry.is_dir():
+                subdirs.append(entry.name)
+            elif entry.name.endswith(".jpg"):
+                files.append(entry.name)
+    return mtime, sorted(files), sorted(subdirs)
+
+
+def index_images_paths(dataset_folder, index_path=None, num_threads=16):
+    """Find the JPEG images within dataset_folder and its subdirectories, and return their paths
+    sorted, like sorted(glob(f"{dataset_folder}/**/*.jpg", recursive=True)).
+
+    The directories are listed by a pool of threads, one level of the tree at a time, which is
+    much faster than glob() on network filesystems. The result is saved in index_path (by default
+    next to dataset_folder), and in later runs only the directories whose mtime changed are listed
+    again, while the content of the others is read from the index.
+    """
+    if index_path is None:
+        index_path = dataset_folder + "_images_index.npz"
+    cached_index = {}
+    if os.path.exists(index_path):
+        try:
+            cached_index = load_index(index_path)
+        except Exception as e:
+            logging.info(f"The index of images {index_path} can't be read ({e}), it will be rebuilt.")
+
+    index = {}
+    level = [""]
+    with ThreadPoolExecutor(num_threads) as executor:
+        while len(level) > 0:
+            entries = executor.map(lambda d: scan_dir(dataset_folder, d, cached_index.get(d)), level)
+            next_level = []
+            for rel_dir, entry in zip(level, entries):
+                index[rel_dir] = entry
+                next_level += [os.path.join(rel_dir, s) for s in entry[2]]
+            level = next_level
+
+    changed_dirs_num = sum([cached_index.get(d) is not index[d] for d in index])
+    logging.debug(f"Listed {changed_dirs_num} new or changed directories out of {len(index)} within {dataset_folder}")
+    if changed_dirs_num > 0 or len(index) != len(cached_index):
+        try:
+            save_index(index, index_path)
+        except OSError as e:
+            logging.info(f"The index of images can't be saved to {index_path} ({e}).")
+
+    images_paths = [os.path.join(dataset_folder, d, f) for d, (_, files, _) in index.items() for f in files]
+    return sorted(images_paths)
@@ -0,0 +1,96 @@
+import gc
+import os
+import logging
+import numpy as np
+
+from datasets.dataset_utils import get_fingerprint
+
+
+# Index of each numeric field within the paths, which are formatted like
+# path/to/file/@utm_east@utm_north@utm_zone_number@utm_zone_letter@latitude@longitude
+# @pano_id@tile_num@heading@pitch@roll@height@timestamp@note@.jpg
+FIELDS = {
+    "utm_east": 1,
+    "utm_north": 2,
+    "utm_zone_number": 3,
+    "latitude": 5,
+    "longitude": 6,
+    "tile_num": 8,
+    "heading": 9,
+    "pitch": 10,
+    "roll": 11,
+    "height": 12,
+    "timestamp": 13,
+}
+
+
+def parse_column(values):
+    """Convert a sequence of strings to a float64 array, with NaN for the empty strings."""
+    values = list(values)
+    try:
+        # float() runs in C, so this is much faster than converting the values one by one in Python
+        return np.fromiter(map(float, values), dtype=np.float64, count=len(values))
+    except ValueError:
+        return np.array([float(v) if v != "" else np.nan for v in values], dtype=np.float64)
+
+
+def parse_paths_metadata(images_paths, fields=("utm_east", "utm_north", "heading"), chunk_size=1_000_000):
+    """Parse the metadata within the paths, and return them as a dict {field: float64 array},
+    where field is a key of FIELDS and array[i] is the value of the field for images_paths[i]
+    (NaN if the field is empty or missing). The paths are parsed in chunks, so that the
+    split fields of only one chunk are in memory at a time.
+    """
+    fields_idx = [FIELDS[field] for field in fields]
+    # Fields after the last one needed are not split
+    maxsplit = max(fields_idx) + 1
+    columns = {field: np.empty(len(images_paths), dtype=np.float64) for field in fields}
+    # The split paths are millions of lists, which would trigger many (useless) full garbage
+    # collections, taking most of the time, so the garbage collector is paused meanwhile
+    gc_was_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        for start in range(0, len(images_paths), chunk_size):
+            splits = [p.split("@", maxsplit) for p in images_paths[start : start + chunk_size]]
+            if min(map(len, splits)) <= maxsplit:
+                # Paths with fewer fields, where the last item is the extension (e.g. "@.jpg")
+                splits = [s if len(s) > maxsplit else s[:-1] + [""] * (maxsplit + 1 - len(s)) for s in splits]
+            for field, field_idx in zip(fields, fields_idx):
+                columns[field][start : start + len(splits)] = parse_column(s[field_idx] for s in splits)
+            del splits
+    finally:
+        if gc_was_enabled:
+            gc.enable()
+    return columns
+
+
+def read_paths_metadata(dataset_folder, images_paths, fields=("utm_east", "utm_north", "heading"), fingerprint=None):
+    """Return the metadata of the images_paths within dataset_folder, like parse_paths_metadata().
+    The columns are saved in 'dataset_folder'_images_metadata.npz, next to the index of the images
+    (see index_images_paths()), together with a fingerprint of images_paths, so that the paths
+    are parsed only once. Fields which are not in the file yet are parsed and added to it.
+    fingerprint is the one of images_paths, if the caller has already computed it.
+    """
+    metadata_path = dataset_folder + "_images_metadata.npz"
+    if fingerprint is None:
+        fingerprint = get_fingerprint(images_paths)
+    columns = {}
+    if os.path.exists(metadata_path):
+        try:
+            with np.load(metadata_path) as arrays:
+                if str(arrays["fingerprint"]) == fingerprint:
+                    columns = {name: arrays[name] for name in arrays.files if name != "fingerprint"}
+        except Exception as e:
+            logging.info(f"The metadata of the images {metadata_path} can't be read ({e}), they will be parsed again.")
+
+    missing_fields = [field for field in fields if field not in columns]
+    if len(missing_fields) > 0:
+        logging.debug(f"Parsing {missing_fields} from the paths of {len(images_paths)} images within {dataset_folder}")
+        columns.update(parse_paths_metadata(images_paths, missing_fields))
+        try:
+            # Write to a temporary file first, so that an interrupted run does not leave a broken file
+            with open(metadata_path + ".tmp", "wb") as file:
+                np.savez(file, fingerprint=np.array(fingerprint), **columns)
+            os.replace(metadata_path + ".tmp", metadata_path)
+        except OSError as e:
+            logging.info(f"The metadata of the images can't be saved to {metadata_path} ({e}).")
+    return {field: columns[field] for field in fields}
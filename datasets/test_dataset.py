@@ -1,18 +1,19 @@
 
 import os
+import torch
 import numpy as np
-from PIL import Image
 import torch.utils.data as data
 import torchvision.transforms as transforms
 from sklearn.neighbors import NearestNeighbors
 
 import datasets.dataset_utils as dataset_utils
+from datasets.paths_metadata import read_paths_metadata
 
 
 class TestDataset(data.Dataset):
     def __init__(self, dataset_folder, database_folder="database",
                  queries_folder="queries", positive_dist_threshold=25,
-                 image_size=512, resize_test_imgs=False):
+                 image_size=512, resize_test_imgs=False, decode_backend="pil"):
         self.database_folder = dataset_folder + "/" + database_folder
         self.queries_folder = dataset_folder + "/" + queries_folder
         self.database_paths = dataset_utils.read_images_paths(self.database_folder, get_abs_path=True)
@@ -22,8 +23,10 @@ class TestDataset(data.Dataset):
         
         #### Read paths and UTM coordinates for all images.
         # The format must be path/to/file/@utm_easting@utm_northing@...@.jpg
-        self.database_utms = np.array([(path.split("@")[1], path.split("@")[2]) for path in self.database_paths]).astype(float)
-        self.queries_utms = np.array([(path.split("@")[1], path.split("@")[2]) for path in self.queries_paths]).astype(float)
+        database_metadata = read_paths_metadata(self.database_folder, self.database_paths, ["utm_east", "utm_north"])
+        queries_metadata = read_paths_metadata(self.queries_folder, self.queries_paths, ["utm_east", "utm_north"])
+        self.database_utms = np.stack([database_metadata["utm_east"], database_metadata["utm_north"]], axis=1)
+        self.queries_utms = np.stack([queries_metadata["utm_east"], queries_metadata["utm_north"]], axis=1)
         
         # Find positives_per_query, which are within positive_dist_threshold (default 25 meters)
         knn = NearestNeighbors(n_jobs=-1)
@@ -37,24 +40,26 @@ class TestDataset(data.Dataset):
         self.database_num = len(self.database_paths)
         self.queries_num = len(self.queries_paths)
 
+        self.decode_backend = decode_backend
+        # With resize_test_imgs, the "pil_draft" backend decodes the images directly at a smaller size,
+        # as long as the shorter side stays >= image_size
+        self.min_size = image_size if resize_test_imgs else None
+        
+        # The images are resized while they are uint8, and converted to float as the last step
         transforms_list = []
         if resize_test_imgs:
             # Resize to image_size along the shorter side while maintaining aspect ratio
             transforms_list += [transforms.Resize(image_size, antialias=True)]
         transforms_list += [
-                transforms.ToTensor(),
+                transforms.ConvertImageDtype(torch.float),
                 transforms.Normalize(mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225]),
             ]
         self.base_transform = transforms.Compose(transforms_list)
     
-    @staticmethod
-    def open_image(path):
-        return Image.open(path).convert("RGB")
-    
     def __getitem__(self, index):
         image_path = self.images_paths[index]
-        pil_img = TestDataset.open_image(image_path)
-        normalized_img = self.base_transform(pil_img)
+        tensor_img = dataset_utils.open_image(image_path, self.decode_backend, self.min_size)
+        normalized_img = self.base_transform(tensor_img)
         return normalized_img, index
     
     def __len__(self):
@@ -0,0 +1,50 @@
+import os
+import torch
+import random
+
+from datasets.image_shards import ImageShards
+from datasets.compact_cache import CompactCache
+
+
+class PickledCache:
+    def __init__(self, filename):
+        """Cache saved with torch.save, as (classes_per_group, images_per_class).
+        The caches made by cache_generating also contain the headings with which each path is used,
+        as (classes_per_group, images_per_class, headings), so that each path is stored only once.
+        It has the same methods as CompactCache, so that TrainDataset can use either of them.
+        """
+        self.classes_per_group, self.images_per_class, *headings = torch.load(filename)
+        self.headings = headings[0] if len(headings) > 0 else None
+
+    @property
+    def groups_num(self):
+        return len(self.classes_per_group)
+
+    def get_classes_num(self, group_num):
+        return len(self.classes_per_group[group_num])
+
+    def get_images_num(self, group_num):
+        """Return the number of images within a group, counting each path once per heading."""
+        paths_num = sum([len(self.images_per_class[c]) for c in self.classes_per_group[group_num]])
+        return paths_num if self.headings is None else paths_num * len(self.headings)
+
+    def get_class_paths(self, group_num, class_num):
+        return self.images_per_class[self.classes_per_group[group_num][class_num]]
+
+    def get_random_paths(self, group_num, classes_nums):
+        """Return the path of a random image of each class."""
+        return [random.choice(self.images_per_class[self.classes_per_group[group_num][class_num]])
+                for class_num in classes_nums]
+
+
+def load_train_cache(filename):
+    """Load a cache made with torch.save, or a folder made with datasets/compact_cache.py
+    or with datasets/image_shards.py.
+    """
+    if os.path.isfile(os.path.join(filename, "shards_offsets.npy")):
+        # Compact cache with the decoded images
+        return ImageShards(filename)
+    if os.path.isdir(filename):
+        # Compact cache, which is memory-mapped
+        return CompactCache(filename)
+    return PickledCache(filename)
@@ -1,14 +1,20 @@
 import os
+import glob
+import bisect
+import math
 import torch
-import random
 import logging
 import numpy as np
-from PIL import Image
 from PIL import ImageFile
 import torchvision.transforms as T
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 
+import augmentations
 import datasets.dataset_utils as dataset_utils
+from datasets.image_shards import ImageShards
+from datasets.paths_metadata import parse_paths_metadata, read_paths_metadata
+from datasets.train_cache import load_train_cache
 
 
 ImageFile.LOAD_TRUNCATED_IMAGES = True
@@ -16,7 +22,7 @@ ImageFile.LOAD_TRUNCATED_IMAGES = True
 
 class TrainDataset(torch.utils.data.Dataset):
     def __init__(self, args, dataset_folder, M=10, alpha=30, N=5, L=2,
-                 current_group=0, min_images_per_class=10):
+                 current_group=0, min_images_per_class=10, cache_filename=None, cache=None):
         """
         Parameters (please check our paper for a clearer explanation of the parameters).
         ----------
@@ -28,6 +34,11 @@ class TrainDataset(torch.utils.data.Dataset):
         L : int, distance (alpha-wise) between two classes of the same group.
         current_group : int, which one of the groups to consider.
         min_images_per_class : int, minimum number of image in a class.
+        cache_filename : str, path of the cache to use, e.g. made with cache_generating/build_cache.py.
+            If None, the cache is named after a fingerprint of the images and of the parameters,
+            so that it is rebuilt whenever any of them changes.
+        cache : the cache returned by TrainDataset.get_cache(), which can be shared by the datasets
+            of all the groups, each one being a view of its group. If None, the cache is loaded.
         """
         super().__init__()
         self.M = M
@@ -37,92 +48,178 @@ class TrainDataset(torch.utils.data.Dataset):
         self.current_group = current_group
         self.dataset_folder = dataset_folder
         self.augmentation_device = args.augmentation_device
+        self.decode_backend = args.decode_backend
+        self.reading_threads = args.reading_threads
+        self.executor = None
+        self.executor_pid = None
+        # The smallest crop of RandomResizedCrop has sides of about image_size / sqrt(scale * 3/4) pixels,
+        # so with the "pil_draft" backend the images are decoded as small as possible without upsampling it
+        self.min_size = math.ceil(args.image_size / math.sqrt((1 - args.random_resized_crop) * 3 / 4))
         
-        # dataset_name should be either "processed", "small" or "raw", if you're using SF-XL
-        dataset_name = os.path.basename(dataset_folder)
-        filename = 'input your path'  # Change your cache file name here
-        if not os.path.exists(filename):
-            os.makedirs("cache", exist_ok=True)
-            logging.info(f"Cached dataset {filename} does not exist, I'll create it now.")
-            self.initialize(dataset_folder, M, N, alpha, L, min_images_per_class, filename)
-        elif current_group == 0:
-            logging.info(f"Using cached dataset {filename}")
+        if cache is None:
+            cache = TrainDataset.get_cache(dataset_folder, M, alpha, N, L, min_images_per_class, cache_filename)
+        self.cache = cache
         
-        classes_per_group, self.images_per_class = torch.load(filename)
-
-        if current_group >= len(classes_per_group):
-            raise ValueError(f"With this configuration there are only {len(classes_per_group)} " +
+        if current_group >= self.cache.groups_num:
+            raise ValueError(f"With this configuration there are only {self.cache.groups_num} " +
                              f"groups, therefore I can't create the {current_group}th group. " +
                              "You should reduce the number of groups by setting for example " +
                              f"'--groups_num {current_group}'")
-        self.classes_ids = classes_per_group[current_group]
+        
+        if isinstance(self.cache, ImageShards):
+            images_size = 512  # The shards have the images decoded at full size
+        else:
+            images_size = dataset_utils.get_decoded_size(512, self.decode_backend, self.min_size)
+        self.images_shape = torch.Size([3, images_size, images_size])
         
         if self.augmentation_device == "cpu":
+            # The image is cropped and resized while it is still uint8, and converted to float only
+            # at image_size, so that the color jitter and the normalization process fewer pixels, with
+            # 4 bytes each. The transform is applied to a batch of one image, like on GPU
             self.transform = T.Compose([
-                    T.ColorJitter(brightness=args.brightness,
-                                  contrast=args.contrast,
-                                  saturation=args.saturation,
-                                  hue=args.hue),
                     T.RandomResizedCrop([args.image_size, args.image_size], scale=[1-args.random_resized_crop, 1], antialias=True),
-                    T.Normalize(mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225]),
+                    T.ConvertImageDtype(torch.float),
+                    augmentations.DeviceAgnosticColorJitter(brightness=args.brightness,
+                                                            contrast=args.contrast,
+                                                            saturation=args.saturation,
+                                                            hue=args.hue),
+                    T.Normalize(mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225], inplace=True),
                 ])
     
-    @staticmethod
-    def open_image(path):
-        return Image.open(path).convert("RGB")
-    
     def __getitem__(self, class_num):
         # This function takes as input the class_num instead of the index of
         # the image. This way each class is equally represented during training.
+        return self.__getitems__([class_num])[0]
+    
+    def __getitems__(self, classes_nums):
+        """Return the items of a batch of classes, like [self[c] for c in classes_nums].
+        The DataLoader calls it (instead of __getitem__) with all the classes of a batch: a random
+        image of each class is picked at once, and the images are read and transformed by a pool
+        of reading_threads threads, so that the latency of the storage is overlapped.
+        """
+        if isinstance(self.cache, ImageShards):
+            # The images are already decoded, so they are only copied from the shards
+            images_idx = self.cache.get_random_images(self.current_group, classes_nums)
+            paths = [self.cache.get_path(image_idx) for image_idx in images_idx]
+        else:
+            images_idx = [None] * len(classes_nums)
+            paths = self.cache.get_random_paths(self.current_group, classes_nums)
+            if self.cache.headings is not None:
+                headings = np.random.choice(self.cache.headings, len(paths)).tolist()
+                paths = [dataset_utils.change_heading(p, h) for p, h in zip(paths, headings)]
         
-        class_id = self.classes_ids[class_num]
-        # Pick a random image among those in this class.
-        image_path = os.path.join(self.dataset_folder, random.choice(self.images_per_class[class_id]))
-        
-        try:
-            pil_image = TrainDataset.open_image(image_path)
-        except Exception as e:
-            logging.info(f"ERROR image {image_path} couldn't be opened, it might be corrupted.")
-            raise e
-        
-        tensor_image = T.functional.to_tensor(pil_image)
-        assert tensor_image.shape == torch.Size([3, 512, 512]), \
-            f"Image {image_path} should have shape [3, 512, 512] but has {tensor_image.shape}."
+        if self.reading_threads > 1 and len(classes_nums) > 1:
+            # Threads do not survive fork(), so each DataLoader worker starts its own pool
+            if self.executor_pid != os.getpid():
+                self.executor = ThreadPoolExecutor(self.reading_threads)
+                self.executor_pid = os.getpid()
+            return list(self.executor.map(self.get_item, classes_nums, paths, images_idx))
+        return list(map(self.get_item, classes_nums, paths, images_idx))
+    
+    def get_item(self, class_num, path, image_idx=None):
+        """Read and transform the image with the given path, or with index image_idx within the shards."""
+        image_path = os.path.join(self.dataset_folder, path)
+        if image_idx is not None:
+            tensor_image = torch.from_numpy(np.array(self.cache.get_image(image_idx)))
+        else:
+            try:
+                tensor_image = dataset_utils.open_image(image_path, self.decode_backend, self.min_size)
+            except Exception as e:
+                logging.info(f"ERROR image {image_path} couldn't be opened, it might be corrupted.")
+                raise e
+        assert tensor_image.shape == self.images_shape, \
+            f"Image {image_path} should have shape {list(self.images_shape)} but has {tensor_image.shape}."
         
+        # The image is uint8, and it is converted to float only by the augmentations, so that
+        # with augmentation_device == "cuda" the DataLoader workers send 4 times fewer bytes
         if self.augmentation_device == "cpu":
-            tensor_image = self.transform(tensor_image)
+            tensor_image = self.transform(tensor_image.unsqueeze(0)).squeeze(0)
         
         return tensor_image, class_num, image_path
     
+    def __getstate__(self):
+        # The pool of threads can't be pickled (e.g. by DataLoader workers started with spawn)
+        state = self.__dict__.copy()
+        state["executor"] = state["executor_pid"] = None
+        return state
+    
     def get_images_num(self):
         """Return the number of images within this group."""
-        return sum([len(self.images_per_class[c]) for c in self.classes_ids])
+        return self.cache.get_images_num(self.current_group)
     
     def __len__(self):
         """Return the number of classes within this group."""
-        return len(self.classes_ids)
+        return self.cache.get_classes_num(self.current_group)
     
     @staticmethod
-    def initialize(dataset_folder, M, N, alpha, L, min_images_per_class, filename):
-        logging.debug(f"Searching training images in {dataset_folder}")
-        
-        images_paths = dataset_utils.read_images_paths(dataset_folder)
+    def get_cache(dataset_folder, M=10, alpha=30, N=5, L=2, min_images_per_class=10, cache_filename=None):
+        """Return the cache with the classes of all the groups, creating it if it does not exist.
+        Loading it once and passing it to the TrainDataset of each group avoids loading it
+        (and keeping it in memory) once per group.
+        """
+        # dataset_name should be either "processed", "small" or "raw", if you're using SF-XL
+        dataset_name = os.path.basename(dataset_folder)
+        images_paths = fingerprint = None
+        if cache_filename is not None:
+            filename = cache_filename
+        else:
+            images_paths = dataset_utils.read_images_paths(dataset_folder)
+            fingerprint = dataset_utils.get_fingerprint(images_paths)
+            filename = f"cache/{dataset_name}_M{M}_N{N}_alpha{alpha}_L{L}_mipc{min_images_per_class}_{fingerprint}.torch"
+        if not os.path.exists(filename):
+            os.makedirs("cache", exist_ok=True)
+            logging.info(f"Cached dataset {filename} does not exist, I'll create it now.")
+            TrainDataset.initialize(dataset_folder, M, N, alpha, L, min_images_per_class, filename,
+                                    images_paths, fingerprint)
+        else:
+            logging.info(f"Using cached dataset {filename}")
+        return load_train_cache(filename)
+    
+    @staticmethod
+    def initialize(dataset_folder, M, N, alpha, L, min_images_per_class, filename, images_paths=None, fingerprint=None):
+        """Label the images and save the cache to filename. images_paths and their fingerprint
+        are read and computed if they are None.
+        """
+        if images_paths is None:
+            logging.debug(f"Searching training images in {dataset_folder}")
+            images_paths = dataset_utils.read_images_paths(dataset_folder)
+            fingerprint = None
+        if fingerprint is None:
+            fingerprint = dataset_utils.get_fingerprint(images_paths)
         logging.debug(f"Found {len(images_paths)} images")
         
-        logging.debug("For each image, get its UTM east, UTM north and heading from its path")
-        images_metadatas = [p.split("@") for p in images_paths]
-        # field 1 is UTM east, field 2 is UTM north, field 9 is heading
-        utmeast_utmnorth_heading = [(m[1], m[2], m[9]) for m in images_metadatas]
-        utmeast_utmnorth_heading = np.array(utmeast_utmnorth_heading).astype(np.float64)
+        # The state keeps all the classes, also those with fewer than min_images_per_class images,
+        # so that it can be updated when images are added or removed. It does not depend on
+        # min_images_per_class, hence it is shared by caches with different min_images_per_class.
+        dataset_name = os.path.basename(dataset_folder)
+        states_prefix = f"cache/{dataset_name}_M{M}_N{N}_alpha{alpha}_L{L}_state"
+        state_filename = f"{states_prefix}_{fingerprint}.torch"
+        previous_states = sorted(glob.glob(f"{glob.escape(states_prefix)}_*.torch"), key=os.path.getmtime)
         
-        logging.debug("For each image, get class and group to which it belongs")
-        class_id__group_id = [TrainDataset.get__class_id__group_id(*m, M, alpha, N, L)
-                              for m in utmeast_utmnorth_heading]
+        if os.path.exists(state_filename):
+            logging.debug(f"Using the classes from {state_filename}")
+            images_per_class = torch.load(state_filename)
+        elif len(previous_states) > 0:
+            logging.debug(f"Updating the classes from {previous_states[-1]}")
+            images_per_class = torch.load(previous_states[-1])
+            TrainDataset.update_classes(images_per_class, images_paths, M, alpha, N, L)
+            torch.save(images_per_class, state_filename)
+        else:
+            logging.debug("Group together images belonging to the same class")
+            images_per_class = defaultdict(list)
+            # The metadata of all the images are saved next to them, so that they are parsed only once
+            # also when building caches with other parameters
+            metadata = read_paths_metadata(dataset_folder, images_paths, fingerprint=fingerprint)
+            for image_path, class_id in zip(images_paths, TrainDataset.get_classes_ids(images_paths, M, alpha, N, L, metadata)):
+                images_per_class[class_id].append(image_path)
+            images_per_class = dict(images_per_class)
+            torch.save(images_per_class, state_filename)
         
-        logging.debug("Group together images belonging to the same class")
-        images_per_class = defaultdict(list)
-        for image_path, (class_id, _) in zip(images_paths, class_id__group_id):
-            images_per_class[class_id].append(image_path)
+        # Each state has the paths of all the images, so only the newest one is kept
+        for previous_state in previous_states:
+            if previous_state != state_filename:
+                logging.debug(f"Removing the outdated classes in {previous_state}")
+                os.remove(previous_state)
         
         # Images_per_class is a dict where the key is class_id, and the value
         # is a list with the paths of images within that class.
@@ -131,18 +228,75 @@ class TrainDataset(torch.utils.data.Dataset):
         logging.debug("Group together classes belonging to the same group")
         # Classes_per_group is a dict where the key is group_id, and the value
         # is a list with the class_ids belonging to that group.
-        classes_per_group = defaultdict(set)
-        for class_id, group_id in class_id__group_id:
-            if class_id not in images_per_class:
-                continue  # Skip classes with too few images
-            classes_per_group[group_id].add(class_id)
+        classes_per_group = defaultdict(list)
+        for class_id in sorted(images_per_class):
+            _, group_id = TrainDataset.get__class_id__group_id(*class_id, M, alpha, N, L)
+            classes_per_group[group_id].append(class_id)
         
-        # Convert classes_per_group to a list of lists.
+        # Convert classes_per_group to a list of lists, sorted by group_id, so that
+        # the cache does not depend on the order of the images.
         # Each sublist represents the classes within a group.
-        classes_per_group = [list(c) for c in classes_per_group.values()]
+        classes_per_group = [classes_per_group[group_id] for group_id in sorted(classes_per_group)]
         
         torch.save((classes_per_group, images_per_class), filename)
     
+    @staticmethod
+    def get_classes_ids(images_paths, M, alpha, N, L, metadata=None):
+        """Return the class_id of each image, computed from the metadata within its path.
+        metadata are the columns returned by parse_paths_metadata(), which are parsed if None.
+        """
+        if metadata is None:
+            logging.debug("For each image, get its UTM east, UTM north and heading from its path")
+            metadata = parse_paths_metadata(images_paths, ["utm_east", "utm_north", "heading"])
+        
+        # Empty or missing fields are parsed as NaN, which would silently become meaningless class ids
+        invalid = ~(np.isfinite(metadata["utm_east"]) & np.isfinite(metadata["utm_north"]) & np.isfinite(metadata["heading"]))
+        if invalid.any():
+            invalid_paths = [images_paths[i] for i in np.flatnonzero(invalid)[:5]]
+            raise ValueError(f"{invalid.sum()} images have no valid UTM east, UTM north or heading in their path, "
+                             f"which must be formatted like path/to/file/@utm_east@utm_north@...@heading@...@.jpg, "
+                             f"e.g. {invalid_paths}")
+        
+        logging.debug("For each image, get class to which it belongs")
+        # Same as the class_id of get__class_id__group_id(), computed for all the images at once
+        rounded_utm_east = (metadata["utm_east"] // M * M).astype(np.int64)
+        rounded_utm_north = (metadata["utm_north"] // M * M).astype(np.int64)
+        rounded_heading = (metadata["heading"] // alpha * alpha).astype(np.int64)
+        return list(zip(rounded_utm_east.tolist(), rounded_utm_north.tolist(), rounded_heading.tolist()))
+    
+    @staticmethod
+    def update_classes(images_per_class, images_paths, M, alpha, N, L):
+        """Update in place images_per_class (with all the classes, as saved in the state files)
+        to the new list of images, labeling only the images which have been added or removed.
+        Classes left without images are deleted, and new classes are created when needed.
+        The result is the same as labeling all the images, also in the order of the classes and of their images.
+        """
+        old_images_paths = {p for paths in images_per_class.values() for p in paths}
+        new_images_paths = set(images_paths)
+        added_paths = [p for p in images_paths if p not in old_images_paths]
+        removed_paths = [p for p in old_images_paths if p not in new_images_paths]
+        logging.debug(f"{len(added_paths)} images have been added and {len(removed_paths)} removed")
+        
+        removed_per_class = defaultdict(set)
+        for image_path, class_id in zip(removed_paths, TrainDataset.get_classes_ids(removed_paths, M, alpha, N, L)):
+            removed_per_class[class_id].add(image_path)
+        for class_id, removed in removed_per_class.items():
+            images_per_class[class_id] = [p for p in images_per_class[class_id] if p not in removed]
+            if len(images_per_class[class_id]) == 0:
+                del images_per_class[class_id]
+        
+        for image_path, class_id in zip(added_paths, TrainDataset.get_classes_ids(added_paths, M, alpha, N, L)):
+            images_per_class.setdefault(class_id, []).append(image_path)
+        
+        # Sort the images within each class, and the classes by their first image, in the order of
+        # images_paths, so that images_per_class is the same that a full build would return
+        position = {image_path: i for i, image_path in enumerate(images_paths)}
+        for paths in images_per_class.values():
+            paths.sort(key=position.__getitem__)
+        sorted_classes = sorted(images_per_class.items(), key=lambda item: position[item[1][0]])
+        images_per_class.clear()
+        images_per_class.update(sorted_classes)
+    
     @staticmethod
     def get__class_id__group_id(utm_east, utm_north, heading, M, alpha, N, L):
         """Return class_id and group_id for a given point.
@@ -163,9 +317,22 @@ class TrainDataset(torch.utils.data.Dataset):
         return class_id, group_id
 
 
+class TrainGroupsDataset(torch.utils.data.ConcatDataset):
+    """ConcatDataset of the TrainDataset of each group. The batches of GroupsBatchSampler
+    are all within one group, so each batch is fetched with TrainDataset.__getitems__.
+    """
+    def __getitems__(self, indexes):
+        group_num = bisect.bisect_right(self.cumulative_sizes, indexes[0])
+        offset = 0 if group_num == 0 else self.cumulative_sizes[group_num - 1]
+        if all(offset <= idx < self.cumulative_sizes[group_num] for idx in indexes):
+            return self.datasets[group_num].__getitems__([idx - offset for idx in indexes])
+        return [self[idx] for idx in indexes]
+
+
 if __name__ == '__main__':
     import parsers
     args = parsers.parse_arguments()
     TrainDataset(args, args.train_set_folder, M=args.M, alpha=args.alpha, N=args.N, L=args.L,
-                               current_group=0, min_images_per_class=args.min_images_per_class)
+                               current_group=0, min_images_per_class=args.min_images_per_class,
+                               cache_filename=args.cache_filename)
     print(1)
\ No newline at end of file
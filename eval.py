@@ -8,7 +8,7 @@ from datetime import datetime
 import test
 import parsers
 import commons
-from cosplace_model import cosplace_network
+from cosplace_model import cosplace_network, quantization
 from datasets.test_dataset import TestDataset
 
 torch.backends.cudnn.benchmark = True  # Provides a speedup
@@ -23,22 +23,32 @@ logging.info(f"Arguments: {args}")
 logging.info(f"The outputs are being saved in {args.output_folder}")
 
 #### Model
-model = cosplace_network.GeoLocalizationNet(args.backbone, args.fc_output_dim)
-
 logging.info(f"There are {torch.cuda.device_count()} GPUs and {multiprocessing.cpu_count()} CPUs.")
 
-if args.resume_model is not None:
-    logging.info(f"Loading model from {args.resume_model}")
-    model_state_dict = torch.load(args.resume_model)
-    model.load_state_dict(model_state_dict)
+if args.quantized_model is not None:
+    logging.info(f"Loading int8 model from {args.quantized_model}")
+    if args.device != "cpu":
+        logging.info("The int8 model runs only on CPU, so it will be evaluated on CPU.")
+        args.device = "cpu"
+    model = quantization.get_quantized_model(args.backbone, args.fc_output_dim)
+    model.load_state_dict(torch.load(args.quantized_model, map_location="cpu"))
 else:
-    logging.info("WARNING: You didn't provide a path to resume the model (--resume_model parameter). " +
-                 "Evaluation will be computed using randomly initialized weights.")
+    model = cosplace_network.GeoLocalizationNet(args.backbone, args.fc_output_dim)
+    if args.resume_model is not None:
+        logging.info(f"Loading model from {args.resume_model}")
+        model_state_dict = torch.load(args.resume_model)
+        model.load_state_dict(model_state_dict)
+    else:
+        logging.info("WARNING: You didn't provide a path to resume the model (--resume_model parameter). " +
+                     "Evaluation will be computed using randomly initialized weights.")
 
 model = model.to(args.device)
+if args.inference_backend != "eager":
+    model = cosplace_network.InferenceNet(model, args.inference_backend)
 
 test_ds = TestDataset(args.test_set_folder, queries_folder="queries_v1",
-                      positive_dist_threshold=args.positive_dist_threshold)
+                      positive_dist_threshold=args.positive_dist_threshold,
+                      decode_backend=args.decode_backend)
 
 recalls, recalls_str = test.test(args, test_ds, model, args.num_preds_to_save)
 logging.info(f"{test_ds}: {recalls_str}")
@@ -0,0 +1,130 @@
+
+"""Export a trained model as TorchScript and ONNX, with a dynamic batch size, so that it can be
+deployed without torchvision and this repo, e.g.
+python export.py --backbone ResNet50 --fc_output_dim 2048 --resume_model path_of_trained_model
+Each exported model is checked to compute the same descriptors of the PyTorch model (on batches of
+different sizes) before being saved. The ONNX export requires the onnx and onnxruntime packages.
+Then benchmark_exported.py measures the speed of the exported models on CPU.
+"""
+
+import os
+import torch
+import inspect
+import logging
+import warnings
+import argparse
+import numpy as np
+
+import commons
+from cosplace_model import cosplace_network
+
+EXPORT_FORMATS = ["torchscript", "onnx"]
+FILE_EXTENSIONS = {"torchscript": ".torchscript.pt", "onnx": ".onnx"}
+
+
+def export_torchscript(model, example_images, path):
+    # The warnings are about the shape checks of the model (e.g. in Flatten), which are only evaluated while tracing
+    with torch.no_grad(), warnings.catch_warnings():
+        warnings.simplefilter("ignore", torch.jit.TracerWarning)
+        traced_model = torch.jit.freeze(torch.jit.trace(model, example_images))
+    torch.jit.save(traced_model, path)
+
+
+def load_torchscript(path):
+    traced_model = torch.jit.load(path, map_location="cpu")
+    return lambda images: traced_model(torch.from_numpy(images)).numpy()
+
+
+def export_onnx(model, example_images, path, opset_version):
+    # Newer versions of pytorch export with torch.export (dynamo=True) by default, which needs
+    # onnxscript, while the TorchScript-based exporter is enough for this model
+    export_kwargs = {"dynamo": False} if "dynamo" in inspect.signature(torch.onnx.export).parameters else {}
+    with torch.no_grad(), warnings.catch_warnings():
+        warnings.simplefilter("ignore", torch.jit.TracerWarning)
+        torch.onnx.export(model, (example_images,), path, input_names=["images"], output_names=["descriptors"],
+                          dynamic_axes={"images": {0: "batch_size"}, "descriptors": {0: "batch_size"}},
+                          opset_version=opset_version, **export_kwargs)
+
+
+def load_onnx(path):
+    import onnxruntime
+    session = onnxruntime.InferenceSession(path, providers=["CPUExecutionProvider"])
+    return lambda images: session.run(None, {"images": images})[0]
+
+
+def check_equivalence(model, load_function, path, image_size, batch_sizes=(1, 3), atol=1e-4):
+    """Check that the exported model in path computes the same descriptors of model, on random
+    batches of each of batch_sizes, and return the largest difference. Raise a RuntimeError otherwise.
+    """
+    exported_model = load_function(path)
+    max_difference = 0
+    for batch_size in batch_sizes:
+        images = torch.rand(batch_size, 3, image_size, image_size)
+        with torch.no_grad():
+            descriptors = model(images).numpy()
+        exported_descriptors = exported_model(images.numpy())
+        if exported_descriptors.shape != descriptors.shape:
+            raise RuntimeError(f"The exported model {path} returns descriptors with shape {exported_descriptors.shape} "
+                               f"for a batch of {batch_size} images, instead of {descriptors.shape}")
+        max_difference = max(max_difference, float(np.abs(exported_descriptors - descriptors).max()))
+    if max_difference > atol:
+        raise RuntimeError(f"The descriptors of the exported model {path} differ by up to {max_difference:.2e} "
+                           f"from the ones of the PyTorch model, more than the tolerance of {atol:.0e}")
+    return max_difference
+
+
+def export_model(model, export_format, path, image_size=512, opset_version=17, atol=1e-4):
+    """Export model (in eval mode, on CPU) in export_format (one of EXPORT_FORMATS) to path, if its
+    descriptors match the ones of model within atol, and return the largest difference between them.
+    The model is traced with a batch of 2 images, and checked with batches of other sizes, so that
+    the batch size is not hard-coded in the exported model.
+    """
+    example_images = torch.rand(2, 3, image_size, image_size)
+    if export_format not in EXPORT_FORMATS:
+        raise ValueError(f"export_format must be one of {EXPORT_FORMATS}, not {export_format}")
+    # The model is exported to a temporary file, which replaces path only if the check passes
+    try:
+        if export_format == "torchscript":
+            export_torchscript(model, example_images, path + ".tmp")
+            max_difference = check_equivalence(model, load_torchscript, path + ".tmp", image_size, atol=atol)
+        else:
+            export_onnx(model, example_images, path + ".tmp", opset_version)
+            max_difference = check_equivalence(model, load_onnx, path + ".tmp", image_size, atol=atol)
+    except Exception:
+        if os.path.exists(path + ".tmp"):
+            os.remove(path + ".tmp")
+        raise
+    os.replace(path + ".tmp", path)
+    return max_difference
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument("--backbone", type=str, default="ResNet50",
+                        choices=list(cosplace_network.CHANNELS_NUM_IN_LAST_CONV), help="_")
+    parser.add_argument("--fc_output_dim", type=int, default=2048, help="_")
+    parser.add_argument("--resume_model", type=str, default=None, help="path to the weights of the model")
+    parser.add_argument("--formats", type=str, nargs="+", default=EXPORT_FORMATS, choices=EXPORT_FORMATS, help="_")
+    parser.add_argument("--image_size", type=int, default=512,
+                        help="size of the images used to export and check the model")
+    parser.add_argument("--opset_version", type=int, default=17, help="ONNX opset version")
+    parser.add_argument("--atol", type=float, default=1e-4,
+                        help="largest difference allowed between the descriptors of the exported and PyTorch models")
+    parser.add_argument("--output_folder", type=str, default="exported_models", help="_")
+    args = parser.parse_args()
+
+    commons.setup_logging(args.output_folder, exist_ok=True, console="info")
+    model = cosplace_network.GeoLocalizationNet(args.backbone, args.fc_output_dim)
+    if args.resume_model is not None:
+        logging.info(f"Loading model from {args.resume_model}")
+        model.load_state_dict(torch.load(args.resume_model, map_location="cpu"))
+    else:
+        logging.info("WARNING: You didn't provide a path to resume the model (--resume_model parameter). " +
+                     "The exported model will have randomly initialized weights.")
+    model = model.eval()
+
+    for export_format in args.formats:
+        path = f"{args.output_folder}/{args.backbone}_{args.fc_output_dim}{FILE_EXTENSIONS[export_format]}"
+        max_difference = export_model(model, export_format, path, args.image_size, args.opset_version, args.atol)
+        logging.info(f"Exported the model as {export_format} to {path}, the largest difference of its "
+                     f"descriptors from the ones of the PyTorch model is {max_difference:.2e}")
@@ -2,7 +2,7 @@
 dependencies = ['torch', 'torchvision']
 
 import torch
-from cosplace_model import cosplace_network
+from cosplace_model import cosplace_network, quantization
 
 
 AVAILABLE_TRAINED_MODELS = {
@@ -15,13 +15,16 @@ AVAILABLE_TRAINED_MODELS = {
 }
 
 
-def get_trained_model(backbone : str = "ResNet50", fc_output_dim : int = 2048) -> torch.nn.Module:
+def get_trained_model(backbone : str = "ResNet50", fc_output_dim : int = 2048,
+                      quantized_model_path : str = None) -> torch.nn.Module:
     """Return a model trained with CosPlace on San Francisco eXtra Large.
     
     Args:
         backbone (str): which torchvision backbone to use. Must be VGG16 or a ResNet.
         fc_output_dim (int): the output dimension of the last fc layer, equivalent to
             the descriptors dimension. Must be between 32 and 2048, depending on model's availability.
+        quantized_model_path (str): path to an int8 version of the model, made with quantize.py.
+            If given, return the int8 model, which runs on CPU, instead of the float one.
     
     Return:
         model (torch.nn.Module): a trained model.
@@ -36,6 +39,10 @@ def get_trained_model(backbone : str = "ResNet50", fc_output_dim : int = 2048) -
     if fc_output_dim not in AVAILABLE_TRAINED_MODELS[backbone]:
         raise ValueError(f"Parameter `fc_output_dim` is set to {fc_output_dim}, but for backbone {backbone} "
                          f"it must be one of {list(AVAILABLE_TRAINED_MODELS[backbone])}")
+    if quantized_model_path is not None:
+        model = quantization.get_quantized_model(backbone, fc_output_dim)
+        model.load_state_dict(torch.load(quantized_model_path, map_location=torch.device('cpu')))
+        return model
     model = cosplace_network.GeoLocalizationNet(backbone, fc_output_dim)
     model.load_state_dict(
         torch.hub.load_state_dict_from_url(
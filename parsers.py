@@ -3,7 +3,17 @@ import argparse
 
 def parse_arguments(is_training: bool = True):
     parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    # CosPlace Groups parameters
+    parser.add_argument("--M", type=int, default=10, help="_")
+    parser.add_argument("--alpha", type=int, default=30, help="_")
+    parser.add_argument("--N", type=int, default=5, help="_")
+    parser.add_argument("--L", type=int, default=2, help="_")
     parser.add_argument("--groups_num", type=int, default=16, help="_")
+    parser.add_argument("--min_images_per_class", type=int, default=10, help="_")
+    parser.add_argument("--cache_filename", type=str, default=None,
+                        help="path of the training cache, e.g. made with cache_generating/build_cache.py. "
+                        "If None, the cache is built within cache/ and named after a fingerprint of the "
+                        "training images and of the parameters")
     # Model parameters
     parser.add_argument("--backbone", type=str, default="VGG16",
                         choices=["VGG16",
@@ -22,15 +32,28 @@ def parse_arguments(is_training: bool = True):
                         choices=["cuda", "cpu"],
                         help="on which device to run data augmentation")
     parser.add_argument("--batch_size", type=int, default=64, help="_")
+    parser.add_argument("--micro_batches", type=int, default=1,
+                        help="split each batch in this many micro-batches, which go through the model one at a "
+                        "time, accumulating the gradients, to train with batch_size with less memory")
+    parser.add_argument("--activation_checkpointing", action="store_true",
+                        help="recompute the activations of the trainable stages of the backbone in the backward, "
+                        "instead of keeping them in memory (not available for VGG16)")
     parser.add_argument("--epochs_num", type=int, default=48, help="_")
     parser.add_argument("--iterations_per_epoch", type=int, default=10000, help="_")
     parser.add_argument("--lr", type=float, default=0.00001, help="_")
     parser.add_argument("--classifiers_lr", type=float, default=0.01, help="_")
+    parser.add_argument("--stage_next_group_iterations", type=int, default=100,
+                        help="start moving the classifier of the next group to the GPU this many iterations "
+                        "before the end of each epoch (it needs the memory of two classifiers), 0 to disable")
     parser.add_argument("--image_size", type=int, default=512,
                         help="Width and height of training images (1:1 aspect ratio))")
     parser.add_argument("--resize_test_imgs", default=False, action="store_true",
                         help="If the test images should be resized to image_size along"
                           "the shorter side while maintaining aspect ratio")
+    parser.add_argument("--decode_backend", type=str, default="pil",
+                        choices=["pil", "pil_draft", "torchvision"],
+                        help="how to decode the images: pil_draft decodes JPEGs directly at a smaller "
+                        "size when --image_size or --resize_test_imgs allow it, torchvision uses libjpeg-turbo")
     # Data augmentation
     parser.add_argument("--brightness", type=float, default=0.7, help="_")
     parser.add_argument("--contrast", type=float, default=0.7, help="_")
@@ -44,16 +67,27 @@ def parse_arguments(is_training: bool = True):
                         help="Batch size for inference (testing)")
     parser.add_argument("--positive_dist_threshold", type=int, default=25,
                         help="distance in meters for a prediction to be considered a positive")
+    parser.add_argument("--inference_backend", type=str, default="eager",
+                        choices=["eager", "channels_last", "compile", "torchscript"],
+                        help="how eval.py and test_ckpt.py run the model, see cosplace_network.InferenceNet")
+    parser.add_argument("--calibration_images_num", type=int, default=512,
+                        help="number of database images on which quantize.py calibrates the int8 model")
     # Resume parameters
     parser.add_argument("--resume_train", type=str, default=None,
                         help="path to checkpoint to resume, e.g. logs/.../last_checkpoint.pth")
     parser.add_argument("--resume_model", type=str, default=None,
                         help="path to model to resume, e.g. logs/.../best_model.pth")
+    parser.add_argument("--quantized_model", type=str, default=None,
+                        help="path to an int8 model made with quantize.py, e.g. logs/.../quantized_model.pth, "
+                        "to evaluate instead of --resume_model (on CPU)")
     # Other parameters
     parser.add_argument("--device", type=str, default="cuda",
                         choices=["cuda", "cpu"], help="_")
     parser.add_argument("--seed", type=int, default=0, help="_")
     parser.add_argument("--num_workers", type=int, default=1, help="_")
+    parser.add_argument("--reading_threads", type=int, default=4,
+                        help="number of threads with which each DataLoader worker reads the images of a "
+                        "batch in parallel, so that fewer workers are needed with high-latency storage")
     parser.add_argument("--val_num_workers", type=int, default=2, help="_")
     parser.add_argument("--test_num_workers", type=int, default=2, help="_")
     parser.add_argument("--num_preds_to_save", type=int, default=0,
@@ -75,5 +109,9 @@ def parse_arguments(is_training: bool = True):
     
     args = parser.parse_args()
     
+    if is_training and not 1 <= args.micro_batches <= args.batch_size:
+        raise ValueError(f"--micro_batches must be between 1 and --batch_size ({args.batch_size}), "
+                         f"but it is set to {args.micro_batches}")
+    
     return args
 
@@ -0,0 +1,77 @@
+
+"""Quantize a trained model to int8 for CPU inference, and compare it with the float model, e.g.
+python quantize.py --backbone ResNet50 --fc_output_dim 2048 --resume_model path_of_trained_model
+The int8 model is saved in the output folder as quantized_model.pth, and can be evaluated with
+python eval.py --backbone ResNet50 --fc_output_dim 2048 --quantized_model logs/.../quantized_model.pth
+"""
+
+import sys
+import torch
+import logging
+import numpy as np
+import multiprocessing
+from datetime import datetime
+from torch.utils.data import DataLoader, Subset
+
+import test
+import util
+import parsers
+import commons
+from cosplace_model import cosplace_network, quantization
+from datasets.test_dataset import TestDataset
+
+args = parsers.parse_arguments(is_training=False)
+start_time = datetime.now()
+args.output_folder = f"logs/{args.save_dir}/{start_time.strftime('%Y-%m-%d_%H-%M-%S')}"
+commons.make_deterministic(args.seed)
+commons.setup_logging(args.output_folder, console="info")
+logging.info(" ".join(sys.argv))
+logging.info(f"Arguments: {args}")
+logging.info(f"The outputs are being saved in {args.output_folder}")
+logging.info(f"There are {multiprocessing.cpu_count()} CPUs, using {torch.get_num_threads()} threads.")
+# The int8 model runs only on CPU, so both models are compared on CPU
+args.device = "cpu"
+
+#### Float model
+model = cosplace_network.GeoLocalizationNet(args.backbone, args.fc_output_dim)
+if args.resume_model is not None:
+    logging.info(f"Loading model from {args.resume_model}")
+    model.load_state_dict(torch.load(args.resume_model, map_location="cpu"))
+else:
+    logging.info("WARNING: You didn't provide a path to resume the model (--resume_model parameter). " +
+                 "The quantization will be done using randomly initialized weights.")
+model = model.eval()
+
+test_ds = TestDataset(args.test_set_folder, queries_folder="queries_v1",
+                      positive_dist_threshold=args.positive_dist_threshold,
+                      decode_backend=args.decode_backend)
+
+#### Calibration on a random subset of the database
+calibration_indices = np.random.choice(test_ds.database_num, min(args.calibration_images_num, test_ds.database_num),
+                                       replace=False)
+calibration_dataloader = DataLoader(Subset(test_ds, calibration_indices.tolist()), num_workers=args.test_num_workers,
+                                    batch_size=args.infer_batch_size)
+logging.info(f"Calibrating the int8 model on {len(calibration_indices)} database images of {test_ds}")
+quantized_model = quantization.quantize_model(model, (images for images, _ in calibration_dataloader))
+torch.save(quantized_model.state_dict(), f"{args.output_folder}/quantized_model.pth")
+logging.info(f"Saved the int8 model in {args.output_folder}/quantized_model.pth")
+
+#### Speed, on a batch of calibration images
+images = next(iter(calibration_dataloader))[0]
+with torch.no_grad():
+    float_speed, float_descriptors = util.images_per_second(model, images, iterations=3, device="cpu")
+    quantized_speed, quantized_descriptors = util.images_per_second(quantized_model, images, iterations=3, device="cpu")
+cosine_similarity = (float_descriptors * quantized_descriptors).sum(1) / \
+    (float_descriptors.norm(dim=1) * quantized_descriptors.norm(dim=1))
+logging.info(f"Float model: {float_speed:.1f} images/sec, int8 model: {quantized_speed:.1f} images/sec "
+             f"(x{quantized_speed / float_speed:.2f}). Mean cosine similarity between the float and int8 "
+             f"descriptors: {cosine_similarity.mean().item():.4f}")
+
+#### Recalls
+float_recalls, float_recalls_str = test.test(args, test_ds, model)
+logging.info(f"Float model on {test_ds}: {float_recalls_str}")
+quantized_recalls, quantized_recalls_str = test.test(args, test_ds, quantized_model)
+logging.info(f"int8 model on {test_ds}: {quantized_recalls_str}")
+recalls_delta_str = ", ".join([f"R@{val}: {delta:+.1f}"
+                               for val, delta in zip(test.RECALL_VALUES, quantized_recalls - float_recalls)])
+logging.info(f"Recalls of the int8 model minus the ones of the float model: {recalls_delta_str}")
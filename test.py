@@ -1,4 +1,5 @@
 
+import time
 import faiss
 import torch
 import logging
@@ -27,10 +28,12 @@ def test(args: Namespace, eval_ds: Dataset, model: torch.nn.Module,
         database_dataloader = DataLoader(dataset=database_subset_ds, num_workers=args.val_num_workers,
                                          batch_size=args.infer_batch_size, pin_memory=(args.device == "cuda"))
         all_descriptors = np.empty((len(eval_ds), args.fc_output_dim), dtype="float32")
+        start_time = time.perf_counter()
         for images, indices in tqdm(database_dataloader, ncols=100):
             descriptors = model(images.to(args.device))
             descriptors = descriptors.cpu().numpy()
             all_descriptors[indices.numpy(), :] = descriptors
+        logging.debug(f"Extracted database descriptors at {eval_ds.database_num / (time.perf_counter() - start_time):.1f} images/sec")
         
         logging.debug("Extracting queries descriptors for evaluation/testing using batch size 1")
         queries_infer_batch_size = 1
@@ -58,7 +61,7 @@ def test(args: Namespace, eval_ds: Dataset, model: torch.nn.Module,
     recalls = np.zeros(len(RECALL_VALUES))
     for query_index, preds in enumerate(predictions):
         for i, n in enumerate(RECALL_VALUES):
-            if np.any(np.in1d(preds[:n], positives_per_query[query_index])):
+            if np.any(np.isin(preds[:n], positives_per_query[query_index])):
                 recalls[i:] += 1
                 break
     
@@ -26,13 +26,16 @@ if __name__ == '__main__':
     args = parsers.parse_arguments()
 
     test_ds = TestDataset(args.test_set_folder, positive_dist_threshold=args.positive_dist_threshold,
-                          image_size=args.image_size, resize_test_imgs=args.resize_test_imgs)
+                          image_size=args.image_size, resize_test_imgs=args.resize_test_imgs,
+                          decode_backend=args.decode_backend)
 
     model = cosplace_network.GeoLocalizationNet(args.backbone, args.fc_output_dim, args.train_all_layers)
 
     best_model_state_dict = torch.load('input your path')
     model.load_state_dict(best_model_state_dict["model_state_dict"])
     model.eval().cuda()
+    if args.inference_backend != "eager":
+        model = cosplace_network.InferenceNet(model, args.inference_backend)
 
     logging.info(f"Now testing on the test set: {test_ds}")
     recalls, recalls_str = test_utils.test(args, test_ds, model, args.num_preds_to_save)
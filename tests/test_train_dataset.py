@@ -0,0 +1,34 @@
+
+import pytest
+import numpy as np
+
+from datasets.train_dataset import TrainDataset
+from datasets.paths_metadata import parse_paths_metadata
+
+VALID_PATH = "folder/@0553451.99@4178246.63@10@S@37.74996@-122.39325@pano1404@@30@@@@201811@@.jpg"
+
+
+def test_classes_ids_of_valid_paths():
+    classes_ids = TrainDataset.get_classes_ids([VALID_PATH], M=10, alpha=30, N=5, L=2)
+    assert classes_ids == [(553450, 4178240, 30)]
+
+
+@pytest.mark.parametrize("malformed_path", [
+    "folder/@@4178246.63@10@S@37.74996@-122.39325@pano1404@@30@@@@201811@@.jpg",  # Empty UTM east
+    "folder/@0553451.99@4178246.63@10@S@37.74996@-122.39325@pano1404@@@@@@201811@@.jpg",  # Empty heading
+    "folder/@0553451.99@4178246.63@.jpg",  # Missing heading
+    "folder/image.jpg",  # No metadata at all
+])
+def test_classes_ids_of_malformed_paths(malformed_path):
+    with pytest.raises(ValueError, match="no valid UTM east, UTM north or heading") as error:
+        TrainDataset.get_classes_ids([VALID_PATH, malformed_path], M=10, alpha=30, N=5, L=2)
+    # Only the path of the malformed image is in the error message
+    assert malformed_path in str(error.value)
+    assert VALID_PATH not in str(error.value)
+
+
+def test_paths_metadata_of_malformed_paths():
+    metadata = parse_paths_metadata(["folder/@@4178246.63@.jpg", VALID_PATH], ["utm_east", "utm_north", "heading"])
+    assert metadata["utm_east"][1] == 553451.99
+    assert metadata["utm_north"][0] == 4178246.63
+    assert np.isnan(metadata["heading"][0])
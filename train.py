@@ -15,7 +15,7 @@ import cosface_loss
 import augmentations
 from cosplace_model import cosplace_network
 from datasets.test_dataset import TestDataset
-from datasets.train_dataset import TrainDataset
+from datasets.train_dataset import TrainDataset, TrainGroupsDataset
 
 torch.backends.cudnn.benchmark = True  # Provides a speedup
 
@@ -31,7 +31,8 @@ def main():
     logging.info(f"There are {torch.cuda.device_count()} GPUs and {multiprocessing.cpu_count()} CPUs.")
 
     # Model
-    model = cosplace_network.GeoLocalizationNet(args.backbone, args.fc_output_dim, args.train_all_layers)
+    model = cosplace_network.GeoLocalizationNet(args.backbone, args.fc_output_dim, args.train_all_layers,
+                                                 args.activation_checkpointing)
 
     # resume train
     if args.resume_model is not None:
@@ -45,8 +46,12 @@ def main():
     criterion = torch.nn.CrossEntropyLoss()
     model_optimizer = torch.optim.Adam(model.parameters(), lr=args.lr)
 
+    # The cache is loaded once, and each group is a view of it
+    cache = TrainDataset.get_cache(args.train_set_folder, M=args.M, alpha=args.alpha, N=args.N, L=args.L,
+                                   min_images_per_class=args.min_images_per_class, cache_filename=args.cache_filename)
     groups = [TrainDataset(args, args.train_set_folder, M=args.M, alpha=args.alpha, N=args.N, L=args.L,
-                           current_group=n, min_images_per_class=args.min_images_per_class) for n in range(args.groups_num)]
+                           current_group=n, min_images_per_class=args.min_images_per_class,
+                           cache=cache) for n in range(args.groups_num)]
     # Each group has its own classifier, which depends on the number of classes in the group
     classifiers = [cosface_loss.MarginCosineProduct(args.fc_output_dim, len(group)) for group in groups]
     classifiers_optimizers = [torch.optim.Adam(classifier.parameters(), lr=args.classifiers_lr) for classifier in classifiers]
@@ -56,10 +61,12 @@ def main():
     logging.info(f"The {len(groups)} groups have respectively the following number of images {[g.get_images_num() for g in groups]}")
 
     val_ds = TestDataset(args.val_set_folder, positive_dist_threshold=args.positive_dist_threshold,
-                         image_size=args.image_size, resize_test_imgs=args.resize_test_imgs)
+                         image_size=args.image_size, resize_test_imgs=args.resize_test_imgs,
+                         decode_backend=args.decode_backend)
     test_ds = TestDataset(args.test_set_folder, queries_folder="queries_v1",
                           positive_dist_threshold=args.positive_dist_threshold,
-                          image_size=args.image_size, resize_test_imgs=args.resize_test_imgs)
+                          image_size=args.image_size, resize_test_imgs=args.resize_test_imgs,
+                          decode_backend=args.decode_backend)
     logging.info(f"Validation set: {val_ds}")
     logging.info(f"Test set: {test_ds}")
 
@@ -94,6 +101,17 @@ def main():
     if args.use_amp16:
         scaler = torch.cuda.amp.GradScaler()
 
+    # A single DataLoader is used for all the epochs, so that its workers are started only once.
+    # The sampler knows which group is used in each epoch, and the targets are the classes within the group
+    batch_sampler = commons.GroupsBatchSampler([len(g) for g in groups],
+                                               [n % args.groups_num for n in range(start_epoch_num, args.epochs_num)],
+                                               args.batch_size, args.iterations_per_epoch)
+    dataloader = torch.utils.data.DataLoader(TrainGroupsDataset(groups), batch_sampler=batch_sampler,
+                                             num_workers=args.num_workers, pin_memory=(args.device == "cuda"))
+    dataloader_iterator = iter(dataloader)
+    # Moves the classifiers and their optimizers between CPU and device, overlapping it with the training
+    group_stager = util.GroupStager(classifiers, classifiers_optimizers, args.device)
+
     for epoch_num in range(start_epoch_num, args.epochs_num):
 
         # Train
@@ -101,53 +119,74 @@ def main():
         # Select classifier and dataloader according to epoch
         current_group_num = epoch_num % args.groups_num
         # current_group_num = 16
-        classifiers[current_group_num] = classifiers[current_group_num].to(args.device)
-        util.move_to_device(classifiers_optimizers[current_group_num], args.device)
-
-        dataloader = commons.InfiniteDataLoader(groups[current_group_num], num_workers=args.num_workers,
-                                                batch_size=args.batch_size, shuffle=True,
-                                                pin_memory=(args.device == "cuda"), drop_last=True)
+        group_stager.activate(current_group_num)
 
-        dataloader_iterator = iter(dataloader)
         model = model.train()
 
         epoch_losses = np.zeros((0, 1), dtype=np.float32)
+        epoch_peak_memories = np.zeros(args.iterations_per_epoch, dtype=np.float32)  # In MB, for each iteration
         for iteration in tqdm(range(args.iterations_per_epoch), ncols=100):
+            if iteration == args.iterations_per_epoch - args.stage_next_group_iterations and epoch_num + 1 < args.epochs_num:
+                # Start moving the classifier of the next group to the device, while this one is training
+                group_stager.stage((epoch_num + 1) % args.groups_num)
+
             images, targets, _ = next(dataloader_iterator)
-            images, targets = images.to(args.device), targets.to(args.device)
+            images = images.to(args.device, non_blocking=True)
+            targets = targets.to(args.device, non_blocking=True)
 
             if args.augmentation_device == "cuda":
-                images = gpu_augmentation(images)
+                # The images are loaded as uint8, and converted to float on the GPU
+                images = gpu_augmentation(images.float().div(255))
 
             model_optimizer.zero_grad()
             classifiers_optimizers[current_group_num].zero_grad()
+            if args.device == "cuda":
+                torch.cuda.reset_peak_memory_stats()
+
+            # The gradients of the micro-batches are accumulated. The loss of each micro-batch is weighted by
+            # its share of the batch, so that the loss and the gradients are the ones of the whole batch
+            # (except for the batch norms, whose statistics are computed within each micro-batch)
+            batch_loss = 0
+            for micro_images, micro_targets in zip(images.tensor_split(args.micro_batches),
+                                                   targets.tensor_split(args.micro_batches)):
+                weight = len(micro_images) / len(images)
+                if not args.use_amp16:
+                    descriptors = model(micro_images)
+                    output = classifiers[current_group_num](descriptors, micro_targets)
+                    loss = criterion(output, micro_targets) * weight
+                    loss.backward()
+                else:  # Use AMP 16
+                    with torch.cuda.amp.autocast():
+                        descriptors = model(micro_images)
+                        output = classifiers[current_group_num](descriptors, micro_targets)
+                        loss = criterion(output, micro_targets) * weight
+                    scaler.scale(loss).backward()
+                batch_loss += loss.item()
+                del loss, output, descriptors, micro_images
+            epoch_losses = np.append(epoch_losses, batch_loss)
+            del images
 
             if not args.use_amp16:
-                descriptors = model(images)
-                output = classifiers[current_group_num](descriptors, targets)
-                loss = criterion(output, targets)
-                loss.backward()
-                epoch_losses = np.append(epoch_losses, loss.item())
-                del loss, output, images
                 model_optimizer.step()
                 classifiers_optimizers[current_group_num].step()
-            else:  # Use AMP 16
-                with torch.cuda.amp.autocast():
-                    descriptors = model(images)
-                    output = classifiers[current_group_num](descriptors, targets)
-                    loss = criterion(output, targets)
-                scaler.scale(loss).backward()
-                epoch_losses = np.append(epoch_losses, loss.item())
-                del loss, output, images
+            else:
                 scaler.step(model_optimizer)
                 scaler.step(classifiers_optimizers[current_group_num])
                 scaler.update()
 
-        classifiers[current_group_num] = classifiers[current_group_num].cpu()
-        util.move_to_device(classifiers_optimizers[current_group_num], "cpu")
+            if args.device == "cuda":
+                epoch_peak_memories[iteration] = torch.cuda.max_memory_allocated() / 2**20
+                if args.micro_batches > 1 or args.activation_checkpointing:
+                    # Only when saving memory, to see how much is needed by each iteration
+                    logging.debug(f"Epoch {epoch_num:02d} iteration {iteration}: loss = {batch_loss:.4f}, "
+                                  f"peak memory = {epoch_peak_memories[iteration]:.0f} MB")
+
+        group_stager.release(current_group_num)
 
         logging.debug(f"Epoch {epoch_num:02d} in {str(datetime.now() - epoch_start_time)[:-7]}, "
-                      f"loss = {epoch_losses.mean():.4f}")
+                      f"loss = {epoch_losses.mean():.4f}" +
+                      (f", peak memory = {epoch_peak_memories.max():.0f} MB (mean over the iterations "
+                       f"{epoch_peak_memories.mean():.0f} MB)" if args.device == "cuda" else ""))
 
         # Evaluation
         recalls, recalls_str = test.test(args, val_ds, model)
@@ -155,6 +194,7 @@ def main():
         is_best = recalls[0] > best_val_recall1
         best_val_recall1 = max(recalls[0], best_val_recall1)
         # Save checkpoint, which contains all training parameters
+        group_stager.synchronize()
         util.save_checkpoint({
             "epoch_num": epoch_num + 1,
             "model_state_dict": model.state_dict(),
@@ -165,6 +205,8 @@ def main():
         }, is_best, args.output_folder, 'epoch_'+str(epoch_num)+'.pth')
 
 
+    del dataloader_iterator  # Shut down the workers of the DataLoader
+
     logging.info(f"Trained for {epoch_num+1:02d} epochs, in total in {str(datetime.now() - start_time)[:-7]}")
 
     # Test best model on test set v1
@@ -1,4 +1,5 @@
 
+import time
 import torch
 import shutil
 import logging
@@ -7,11 +8,100 @@ from argparse import Namespace
 from cosface_loss import MarginCosineProduct
 
 
-def move_to_device(optimizer: Type[torch.optim.Optimizer], device: str):
+def move_to_device(optimizer: Type[torch.optim.Optimizer], device: str, non_blocking: bool = False):
     for state in optimizer.state.values():
         for k, v in state.items():
             if torch.is_tensor(v):
-                state[k] = v.to(device)
+                state[k] = v.to(device, non_blocking=non_blocking)
+
+
+class GroupStager:
+    def __init__(self, classifiers: List[MarginCosineProduct],
+                 classifiers_optimizers: List[Type[torch.optim.Optimizer]], device: str):
+        """Move the classifiers of the groups, and the states of their optimizers, between CPU and device.
+        On CUDA the next group is moved on a separate stream (from pinned memory), so that it can be
+        staged while the current group is still training, and the current group is moved back to
+        the CPU without waiting for the copy to finish, which takes them off the critical path.
+        """
+        self.classifiers = classifiers
+        self.classifiers_optimizers = classifiers_optimizers
+        self.device = device
+        self.stream = torch.cuda.Stream() if device == "cuda" else None
+        self.staged_group_num = None  # Group moved (or being moved) to the device, but not yet activated
+        self.copied_to_cpu = None  # Event recorded after the copies to the CPU
+        if self.stream is not None:
+            for classifier in classifiers:
+                for param in classifier.parameters():
+                    param.data = param.data.pin_memory()
+            for optimizer in classifiers_optimizers:
+                for state in optimizer.state.values():
+                    for k, v in state.items():
+                        if torch.is_tensor(v) and v.device.type == "cpu":
+                            state[k] = v.pin_memory()
+    
+    def get_tensors(self, group_num: int) -> List[torch.Tensor]:
+        tensors = [p.data for p in self.classifiers[group_num].parameters()]
+        tensors += [p.grad for p in self.classifiers[group_num].parameters() if p.grad is not None]
+        for state in self.classifiers_optimizers[group_num].state.values():
+            tensors += [v for v in state.values() if torch.is_tensor(v)]
+        return tensors
+    
+    def move(self, group_num: int, device: str, non_blocking: bool):
+        self.classifiers[group_num] = self.classifiers[group_num].to(device, non_blocking=non_blocking)
+        move_to_device(self.classifiers_optimizers[group_num], device, non_blocking)
+    
+    def stage(self, group_num: int):
+        """Start moving a group to the device, e.g. the next one during the last iterations of an epoch."""
+        if self.staged_group_num == group_num:
+            return
+        if self.stream is None:
+            self.move(group_num, self.device, non_blocking=False)
+        else:
+            self.stream.wait_stream(torch.cuda.current_stream())
+            with torch.cuda.stream(self.stream):
+                self.move(group_num, self.device, non_blocking=True)
+        self.staged_group_num = group_num
+    
+    def activate(self, group_num: int):
+        """Make sure that a group is on the device, and wait for its copies before using it."""
+        self.stage(group_num)
+        if self.stream is not None:
+            torch.cuda.current_stream().wait_stream(self.stream)
+            # The tensors have been allocated on self.stream, but are used on the current stream
+            for tensor in self.get_tensors(group_num):
+                tensor.record_stream(torch.cuda.current_stream())
+        self.staged_group_num = None
+    
+    def release(self, group_num: int):
+        """Move a group back to the CPU, unless it is already staged as the next group."""
+        if self.staged_group_num == group_num:
+            return
+        self.move(group_num, "cpu", non_blocking=self.stream is not None)
+        if self.stream is not None:
+            self.copied_to_cpu = torch.cuda.Event()
+            self.copied_to_cpu.record()
+    
+    def synchronize(self):
+        """Wait for all the copies, i.e. for the released groups to be on the CPU and for the staged
+        group to be on the device, which is needed before reading them, e.g. to save them."""
+        if self.copied_to_cpu is not None:
+            self.copied_to_cpu.synchronize()
+        if self.stream is not None:
+            self.stream.synchronize()
+
+
+def images_per_second(model, images, iterations, device):
+    """Return how many images per second model processes, running it iterations times on images
+    (after a warm-up run), and the descriptors of images."""
+    descriptors = model(images)  # Warm up, and compile/trace the model for the backends which need it
+    if device == "cuda":
+        torch.cuda.synchronize()
+    start_time = time.perf_counter()
+    for _ in range(iterations):
+        model(images)
+    if device == "cuda":
+        torch.cuda.synchronize()
+    return len(images) * iterations / (time.perf_counter() - start_time), descriptors
 
 
 def save_checkpoint(state: dict, is_best: bool, output_folder: str,